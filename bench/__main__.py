@@ -0,0 +1,64 @@
+import argparse
+import asyncio
+import logging
+import sys
+
+from bench.fakes import FakeSession
+from bench.scenarios import SCENARIOS, reset_tables
+from config import settings
+from main import create_bot, create_dispatcher
+from outbound import outbound
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m bench",
+        description="Drive the bot's dispatcher with synthetic updates against a local Postgres",
+    )
+    parser.add_argument("scenarios", nargs="*", metavar="scenario", help=f"one of: {', '.join(SCENARIOS)} (default: all)")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=5, help="messages (or replies) per user")
+    parser.add_argument("--stats-requests", type=int, default=50)
+    parser.add_argument("--api-latency", type=float, default=0.05, help="simulated Bot API latency, seconds")
+    parser.add_argument("--rate-limit", action="store_true", help="keep the outbound rate limiter and flood throttle enabled")
+    parser.add_argument("--reset", action="store_true", help="truncate bot tables before running")
+    args = parser.parse_args()
+    for name in args.scenarios:
+        if name not in SCENARIOS:
+            parser.error(f"unknown scenario {name!r}")
+    args.scenarios = args.scenarios or list(SCENARIOS)
+    return args
+
+
+async def run(args: argparse.Namespace):
+    session = FakeSession(latency=args.api_latency)
+    bot = create_bot(session)
+    if not args.rate_limit:
+        bot.session.middleware.unregister(outbound)
+        settings.throttle_rate = 0
+    dp = create_dispatcher()
+
+    await dp.emit_startup(bot=bot, dispatcher=dp)
+    try:
+        if args.reset:
+            await reset_tables()
+        for name in args.scenarios:
+            result = await SCENARIOS[name](dp, bot, session, args)
+            print(result.report())
+            print()
+    finally:
+        await dp.emit_shutdown(bot=bot, dispatcher=dp)
+
+
+def main():
+    args = parse_args()
+    # The harness writes and optionally truncates; never point it at a real deployment
+    if "bench" not in settings.db_name:
+        sys.exit(f"Refusing to run against database {settings.db_name!r}: use a DB_NAME containing 'bench'")
+
+    logging.getLogger().setLevel(logging.WARNING)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,474 @@
+import argparse
+import asyncio
+import json
+import logging
+import sys
+from collections.abc import Awaitable, Callable
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any
+
+import asyncpg
+
+from bench.scenarios import FIRST_USER_ID, reset_tables
+from config import settings
+from database import db
+from partitions import retention_cutoff
+
+# Tables with fewer rows than this may be scanned sequentially
+SEQ_SCAN_ROWS = 10_000
+
+PAST_PARTITIONS = """
+DO $$
+DECLARE
+    month_start TIMESTAMP;
+BEGIN
+    FOR i IN 1..{months} LOOP
+        month_start := date_trunc('month', NOW()) - make_interval(months => i);
+        BEGIN
+            EXECUTE format(
+                'CREATE TABLE IF NOT EXISTS %I PARTITION OF messages FOR VALUES FROM (%L) TO (%L)',
+                'messages_' || to_char(month_start, 'YYYY_MM'), month_start, month_start + INTERVAL '1 month'
+            );
+        EXCEPTION WHEN invalid_object_definition THEN
+            NULL;
+        END;
+    END LOOP;
+END $$;
+"""
+
+# $1 first user id, $2 users, $3 tickets, $4 messages, $5 days of history.
+# Ticket g belongs to user (g - 1) % users and the first users / 10 tickets are
+# open; messages cycle through tickets in created_at order.
+SEED_USERS = """
+INSERT INTO users (id, username, first_name, is_blocked, created_at, last_message_at)
+SELECT
+    $1 + g, 'user' || g, 'User ' || g, g % 1000 = 0,
+    NOW() - make_interval(days => $3),
+    NOW() - make_interval(secs => random() * $3 * 86400)
+FROM generate_series(1, $2::int) g
+"""
+
+SEED_TICKETS = """
+INSERT INTO tickets (user_id, status, created_at, closed_at)
+SELECT
+    $1 + (g - 1) % $2 + 1,
+    CASE WHEN g <= $2 / 10 THEN 'open' ELSE 'closed' END,
+    created_at,
+    CASE WHEN g > $2 / 10 THEN created_at + INTERVAL '1 hour' END
+FROM generate_series(1, $3::int) g,
+    LATERAL (SELECT NOW() - make_interval(secs => ($3 - g)::float / $3 * $4 * 86400) AS created_at) t
+"""
+
+SEED_MESSAGES = """
+INSERT INTO messages (ticket_id, user_id, user_message_id, admin_message_id, direction, created_at)
+SELECT
+    t, $1 + (t - 1) % $2 + 1, g, g,
+    CASE WHEN g % 2 = 0 THEN 'incoming' ELSE 'outgoing' END,
+    NOW() - make_interval(secs => ($4 - g)::float / $4 * $5 * 86400)
+FROM generate_series(1, $4::int) g,
+    LATERAL (SELECT (g - 1) % $3 + 1 AS t) s
+"""
+
+SEED_FIRST_RESPONSE = """
+INSERT INTO first_response (message_id, ticket_id, received_at, responded_at)
+SELECT id, ticket_id, created_at,
+    CASE WHEN id % 50 <> 0 THEN created_at + make_interval(secs => random() * 3 * 3600) END
+FROM messages
+WHERE direction = 'incoming'
+"""
+
+SEED_DAILY_COUNTS = """
+INSERT INTO daily_message_counts (
+    day, incoming, outgoing, responses, response_seconds,
+    responses_5m, responses_30m, responses_2h, responses_over_2h
+)
+SELECT m.day, m.incoming, m.outgoing,
+    COALESCE(r.responses, 0), COALESCE(r.response_seconds, 0),
+    COALESCE(r.responses_5m, 0), COALESCE(r.responses_30m, 0),
+    COALESCE(r.responses_2h, 0), COALESCE(r.responses_over_2h, 0)
+FROM (
+    SELECT created_at::date AS day,
+        COUNT(*) FILTER (WHERE direction = 'incoming') AS incoming,
+        COUNT(*) FILTER (WHERE direction = 'outgoing') AS outgoing
+    FROM messages
+    GROUP BY 1
+) m
+LEFT JOIN (
+    SELECT received_at::date AS day,
+        COUNT(*) AS responses,
+        SUM(EXTRACT(EPOCH FROM elapsed)) AS response_seconds,
+        COUNT(*) FILTER (WHERE elapsed < INTERVAL '5 minutes') AS responses_5m,
+        COUNT(*) FILTER (WHERE elapsed >= INTERVAL '5 minutes' AND elapsed < INTERVAL '30 minutes') AS responses_30m,
+        COUNT(*) FILTER (WHERE elapsed >= INTERVAL '30 minutes' AND elapsed < INTERVAL '2 hours') AS responses_2h,
+        COUNT(*) FILTER (WHERE elapsed >= INTERVAL '2 hours') AS responses_over_2h
+    FROM first_response, LATERAL (SELECT responded_at - received_at AS elapsed) e
+    WHERE responded_at IS NOT NULL
+    GROUP BY 1
+) r USING (day)
+"""
+
+
+async def seed(users: int, messages: int, days: int):
+    tickets = users + users // 2
+    await reset_tables()
+    conn = await db.open_connection()
+    try:
+        # Bulk load without the per-row counter and rollup triggers; the
+        # rollups are filled in one pass afterwards, counters stay at zero
+        await conn.execute("SET session_replication_role = replica")
+        await conn.execute(PAST_PARTITIONS.format(months=days // 28 + 1))
+        for label, query, args in [
+            ("users", SEED_USERS, (FIRST_USER_ID, users, days)),
+            ("tickets", SEED_TICKETS, (FIRST_USER_ID, users, tickets, days)),
+            ("messages", SEED_MESSAGES, (FIRST_USER_ID, users, tickets, messages, days)),
+            ("first_response", SEED_FIRST_RESPONSE, ()),
+            ("daily_message_counts", SEED_DAILY_COUNTS, ()),
+        ]:
+            print(f"seeding {label}...", flush=True)
+            await conn.execute(query, *args)
+        print("vacuum analyze...", flush=True)
+        await conn.execute("VACUUM ANALYZE")
+    finally:
+        await conn.close()
+
+
+class _Rollback(Exception):
+    pass
+
+
+# Stands in for a pool connection: each statement first runs under
+# EXPLAIN ANALYZE in a savepoint that is rolled back, then for real so the
+# Database method gets the rows it expects
+class ExplainingConnection:
+    def __init__(self, conn: asyncpg.Connection):
+        self._conn = conn
+        self.plans: list[dict] = []
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._conn, name)
+
+    async def _explain(self, query: str, args: tuple):
+        try:
+            async with self._conn.transaction():
+                plan = await self._conn.fetchval(f"EXPLAIN (ANALYZE, TIMING OFF, FORMAT JSON) {query}", *args)
+                self.plans.append(json.loads(plan)[0])
+                raise _Rollback
+        except _Rollback:
+            pass
+
+    async def fetch(self, query: str, *args: Any) -> list[asyncpg.Record]:
+        await self._explain(query, args)
+        return await self._conn.fetch(query, *args)
+
+    async def fetchrow(self, query: str, *args: Any) -> asyncpg.Record | None:
+        await self._explain(query, args)
+        return await self._conn.fetchrow(query, *args)
+
+    async def fetchval(self, query: str, *args: Any) -> Any:
+        await self._explain(query, args)
+        return await self._conn.fetchval(query, *args)
+
+    async def execute(self, query: str, *args: Any) -> str:
+        await self._explain(query, args)
+        return await self._conn.execute(query, *args)
+
+
+@dataclass
+class Check:
+    name: str
+    # Gets the setup's result when there is a setup
+    call: Callable[..., Awaitable[Any]]
+    # Root index names that must show up in the plans, conflict arbiters included
+    indexes: tuple[str, ...] = ()
+    # Large tables the query is expected to read in full
+    seq_scans: tuple[str, ...] = ()
+    # Triggers that must fire, so their cost is part of the timing
+    triggers: tuple[str, ...] = ()
+    budget_ms: float = 20.0
+    # Creates the rows the call works on, outside the explained statements
+    setup: Callable[[], Awaitable[Any]] | None = None
+
+
+@dataclass
+class CheckResult:
+    check: Check
+    elapsed_ms: float = 0.0
+    problems: list[str] = field(default_factory=list)
+    plans: list[dict] = field(default_factory=list)
+
+
+def plan_nodes(node: dict):
+    yield node
+    for child in node.get("Plans", ()):
+        yield from plan_nodes(child)
+
+
+def format_plan(node: dict, depth: int = 0) -> list[str]:
+    target = node.get("Index Name") or node.get("Relation Name") or ""
+    line = f"{'  ' * depth}{node['Node Type']} {target}".rstrip()
+    line += f"  (rows={node.get('Actual Rows')})"
+    lines = [line]
+    for child in node.get("Plans", ()):
+        lines.extend(format_plan(child, depth + 1))
+    return lines
+
+
+def format_triggers(plan: dict) -> list[str]:
+    return [
+        f"Trigger {trigger['Trigger Name']} on {trigger['Relation']}  (calls={trigger['Calls']})"
+        for trigger in plan.get("Triggers", ())
+    ]
+
+
+def build_checks(users: int, messages: int) -> list[Check]:
+    user_id = FIRST_USER_ID + 1
+    open_ticket_id = 1
+    # Old enough to be outside the warmed admin message index
+    admin_message_id = messages // 3
+    cutoff = retention_cutoff(datetime.now())
+    now = datetime.now()
+    new_rows = [(open_ticket_id, user_id, None, messages + i, "outgoing") for i in range(1, 11)]
+    replayed = [(user_id, messages + i, messages + i, now) for i in range(11, 21)]
+    # A user cache flush: mostly known users plus a few first sightings
+    flushed = [(user_id + i, f"user{i}", f"User {i}", None, now) for i in range(100)]
+    flushed += [(FIRST_USER_ID + users + i, None, "New", None, now) for i in range(1, 11)]
+
+    async def enqueue_replies() -> list[int]:
+        return [await db.enqueue_outbox(user_id, "text", open_ticket_id, "reply") for _ in range(10)]
+
+    async def claim_replies() -> list[int]:
+        await enqueue_replies()
+        items = await db.claim_outbox(settings.outbox_batch_size, settings.outbox_lease)
+        return [item.id for item in items]
+
+    async def start_broadcast():
+        return await db.create_broadcast("news", None, None, 1)
+
+    broadcast_budget = max(100.0, users / 1000)
+    # outbox, broadcasts and quick_replies stay small and are scanned
+    # sequentially by the planner, so their lookups are held to the budget only
+    return [
+        Check("get_user", lambda: db.get_user(user_id), ("users_pkey",)),
+        Check("get_user_stats", lambda: db.get_user_stats(user_id), ("users_pkey",)),
+        Check("upsert_user", lambda: db.upsert_user(user_id, "user1", "User 1", None), ("users_pkey",)),
+        Check("upsert_users", lambda: db.upsert_users(flushed), ("users_pkey",)),
+        Check("block_user", lambda: db.block_user(user_id), ("users_pkey",), triggers=("trg_users_blocked_notify",)),
+        Check(
+            "unblock_user",
+            lambda _: db.unblock_user(user_id),
+            ("users_pkey",),
+            triggers=("trg_users_blocked_notify",),
+            setup=lambda: db.block_user(user_id),
+        ),
+        Check("get_blocked_user_ids", db.get_blocked_user_ids, ("idx_users_blocked",)),
+        Check("get_open_ticket", lambda: db.get_open_ticket(user_id), ("uq_tickets_open_user",)),
+        Check("ingest_incoming", lambda: db.ingest_incoming(user_id), ("uq_tickets_open_user", "users_pkey")),
+        Check("close_ticket", lambda: db.close_ticket(open_ticket_id), ("tickets_pkey",)),
+        Check(
+            "save_messages",
+            lambda: db.save_messages(new_rows),
+            triggers=("trg_messages_user_count", "trg_messages_stats"),
+        ),
+        Check(
+            "replay_incoming",
+            lambda: db.replay_incoming(replayed),
+            ("idx_messages_admin_message_id",),
+            triggers=("trg_messages_user_count", "trg_messages_stats"),
+        ),
+        Check("lookup_admin_message", lambda: db.lookup_admin_message(admin_message_id), ("idx_messages_admin_message_id",)),
+        Check("warm_admin_messages", lambda: db.warm_admin_messages(settings.admin_index_size), ("messages_pkey",), budget_ms=500.0),
+        Check("enqueue_outbox", lambda: db.enqueue_outbox(user_id, "text", open_ticket_id, "reply")),
+        Check(
+            "claim_outbox",
+            lambda _: db.claim_outbox(settings.outbox_batch_size, settings.outbox_lease),
+            setup=enqueue_replies,
+        ),
+        Check(
+            "complete_outbox",
+            lambda ids: db.complete_outbox([(outbox_id, messages + outbox_id) for outbox_id in ids]),
+            # The answered path of the rollup: ticket 1 has unanswered messages
+            triggers=("trg_messages_user_count", "trg_messages_stats"),
+            setup=claim_replies,
+        ),
+        Check(
+            "retry_outbox",
+            lambda ids: db.retry_outbox(ids, 1.0, "retry after 1s"),
+            setup=claim_replies,
+        ),
+        Check("fail_outbox", lambda ids: db.fail_outbox(ids[0], "forbidden"), setup=claim_replies),
+        Check(
+            "create_broadcast",
+            start_broadcast,
+            ("uq_broadcasts_running",),
+            # Counts the recipients once
+            seq_scans=("users",),
+            budget_ms=broadcast_budget,
+        ),
+        Check(
+            "claim_broadcast",
+            lambda _: db.claim_broadcast(settings.broadcast_lease),
+            budget_ms=broadcast_budget,
+            setup=start_broadcast,
+        ),
+        Check(
+            "broadcast_recipients",
+            lambda: db.broadcast_recipients(user_id, settings.broadcast_batch_size),
+            ("users_pkey",),
+        ),
+        Check(
+            "checkpoint_broadcast",
+            lambda broadcast: db.checkpoint_broadcast(
+                broadcast.id, user_id + 100, 95, 3, [user_id + 7, user_id + 8], settings.broadcast_lease
+            ),
+            ("users_pkey",),
+            setup=start_broadcast,
+        ),
+        Check("release_broadcast", lambda broadcast: db.release_broadcast(broadcast.id), setup=start_broadcast),
+        Check("finish_broadcast", lambda broadcast: db.finish_broadcast(broadcast.id, "done"), setup=start_broadcast),
+        Check("get_quick_replies", db.get_quick_replies),
+        Check("add_quick_reply", lambda: db.add_quick_reply("explain", "text"), ("quick_replies_shortcut_key",)),
+        Check(
+            "delete_quick_reply",
+            lambda _: db.delete_quick_reply("explain"),
+            setup=lambda: db.add_quick_reply("explain", "text"),
+        ),
+        Check("expired_message_partitions", lambda: db.expired_message_partitions(cutoff)),
+        Check("create_message_partitions", lambda: db.create_message_partitions(settings.partition_months_ahead)),
+        Check(
+            "get_stats",
+            lambda: db.get_stats(7),
+            ("idx_users_last_message_at", "uq_tickets_open_user"),
+            # Total users and closed tickets are counted in full
+            seq_scans=("users", "tickets"),
+            budget_ms=max(100.0, users / 1000),
+        ),
+        Check(
+            "get_stats_365",
+            lambda: db.get_stats(365),
+            seq_scans=("users", "tickets", "first_response"),
+            budget_ms=max(500.0, messages / 1000),
+        ),
+    ]
+
+
+# Partition indexes and tables are reported under their parent's name
+async def partition_root(conn: asyncpg.Connection, name: str) -> str:
+    return await conn.fetchval("SELECT COALESCE(pg_partition_root($1::regclass), $1::regclass)::text", name)
+
+
+async def run_check(conn: asyncpg.Connection, check: Check, reltuples: dict[str, float]) -> CheckResult:
+    result = CheckResult(check)
+    recorder = ExplainingConnection(conn)
+    target = conn
+
+    @asynccontextmanager
+    async def acquire(read: bool = False):
+        yield target
+
+    db.acquire = acquire
+    try:
+        # Writes made by the check and its setup are rolled back with it
+        try:
+            async with conn.transaction():
+                if check.setup:
+                    state = await check.setup()
+                    target = recorder
+                    await check.call(state)
+                else:
+                    target = recorder
+                    await check.call()
+                raise _Rollback
+        except _Rollback:
+            pass
+    finally:
+        del db.acquire
+
+    result.plans = recorder.plans
+    used_indexes = set()
+    for plan in recorder.plans:
+        result.elapsed_ms += plan.get("Planning Time", 0) + plan.get("Execution Time", 0)
+        for node in plan_nodes(plan["Plan"]):
+            for index in [node.get("Index Name"), *node.get("Conflict Arbiter Indexes", ())]:
+                if index:
+                    used_indexes.add(await partition_root(conn, index))
+            if node["Node Type"] == "Seq Scan":
+                relation = node["Relation Name"]
+                if await partition_root(conn, relation) not in check.seq_scans and reltuples.get(relation, 0) >= SEQ_SCAN_ROWS:
+                    result.problems.append(f"seq scan on {relation}")
+
+    for index in check.indexes:
+        if index not in used_indexes:
+            result.problems.append(f"{index} not used")
+    fired = {trigger["Trigger Name"] for plan in recorder.plans for trigger in plan.get("Triggers", ())}
+    for trigger in check.triggers:
+        if trigger not in fired:
+            result.problems.append(f"{trigger} did not fire")
+    if result.elapsed_ms > check.budget_ms:
+        result.problems.append(f"over budget ({check.budget_ms:.0f} ms)")
+    return result
+
+
+async def run(args: argparse.Namespace) -> bool:
+    await db.connect()
+    try:
+        if args.seed:
+            await seed(args.users, args.messages, args.days)
+
+        conn = await db.open_connection()
+        try:
+            reltuples = {
+                row["relname"]: row["reltuples"]
+                for row in await conn.fetch("SELECT relname, reltuples FROM pg_class WHERE relkind = 'r'")
+            }
+            results = []
+            for check in build_checks(args.users, args.messages):
+                if args.only and check.name not in args.only:
+                    continue
+                results.append(await run_check(conn, check, reltuples))
+        finally:
+            await conn.close()
+    finally:
+        await db.disconnect()
+
+    ok = True
+    for result in results:
+        status = "ok" if not result.problems else "FAIL"
+        print(f"{result.check.name:<30}{result.elapsed_ms:>10.2f} ms  {status}  {'; '.join(result.problems)}".rstrip())
+        if result.problems:
+            ok = False
+        if result.problems or args.verbose:
+            for plan in result.plans:
+                print("\n".join("    " + line for line in format_plan(plan["Plan"]) + format_triggers(plan)))
+    return ok
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m bench.explain",
+        # A command line tool, not a pytest suite: it needs a seeded Postgres
+        description="Check Database query plans and timings against a seeded local Postgres. "
+        "Exits non-zero when a check fails.",
+    )
+    parser.add_argument("only", nargs="*", metavar="check", help="run only these checks")
+    parser.add_argument("--seed", action="store_true", help="truncate bot tables and load synthetic rows first")
+    parser.add_argument("--users", type=int, default=500_000)
+    parser.add_argument("--messages", type=int, default=3_000_000)
+    parser.add_argument("--days", type=int, default=180, help="days of message history to seed")
+    parser.add_argument("-v", "--verbose", action="store_true", help="print every plan, not only failing ones")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if "bench" not in settings.db_name:
+        sys.exit(f"Refusing to run against database {settings.db_name!r}: use a DB_NAME containing 'bench'")
+
+    logging.getLogger().setLevel(logging.WARNING)
+    if not asyncio.run(run(args)):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
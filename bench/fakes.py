@@ -0,0 +1,80 @@
+import asyncio
+import itertools
+import time
+from collections import Counter
+from typing import Any, AsyncGenerator
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+
+
+class FakeSession(BaseSession):
+    # Answers Bot API calls locally after a simulated network delay and records them
+    def __init__(self, latency: float = 0.05):
+        super().__init__()
+        self.latency = latency
+        self.calls: Counter[str] = Counter()
+        self.forwarded: dict[tuple[int, int], int] = {}
+        self._message_ids = itertools.count(1_000_000)
+
+    async def close(self):
+        pass
+
+    async def make_request(
+        self,
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+        timeout: int | None = None,
+    ) -> TelegramType:
+        name = method.__api_method__
+        self.calls[name] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        result = self._result(bot, method)
+        response = Response[method.__returning__].model_validate(  # type: ignore[name-defined]
+            {"ok": True, "result": result},
+            context={"bot": bot},
+        )
+        return response.result
+
+    async def stream_content(
+        self,
+        url: str,
+        headers: dict[str, Any] | None = None,
+        timeout: int = 30,
+        chunk_size: int = 65536,
+        raise_for_status: bool = True,
+    ) -> AsyncGenerator[bytes, None]:
+        yield b""
+
+    def _result(self, bot: Bot, method: TelegramMethod[Any]) -> Any:
+        name = method.__api_method__
+        if name == "getMe":
+            return {"id": bot.id, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        if name == "forwardMessages":
+            ids = []
+            for message_id in method.message_ids:
+                new_id = next(self._message_ids)
+                self.forwarded[(method.from_chat_id, message_id)] = new_id
+                ids.append({"message_id": new_id})
+            return ids
+        if name == "copyMessage":
+            return {"message_id": next(self._message_ids)}
+        if name.startswith(("send", "forward", "edit")):
+            chat_id = getattr(method, "chat_id", None) or 0
+            message_id = next(self._message_ids)
+            if name == "forwardMessage":
+                self.forwarded[(method.from_chat_id, method.message_id)] = message_id
+            return {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": getattr(method, "text", None) or "",
+            }
+        return True
+
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
@@ -0,0 +1,184 @@
+import asyncio
+import itertools
+import statistics
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+from bench.fakes import FakeSession
+from config import settings
+from database import db
+from metrics import db_pool_acquire_seconds, db_query_seconds
+from outbox import outbox
+from routers.user import bursts
+from user_cache import user_cache
+
+FIRST_USER_ID = 10_000_000
+
+_update_ids = itertools.count(1)
+
+
+@dataclass
+class Result:
+    scenario: str
+    updates: int = 0
+    wall_seconds: float = 0.0
+    cpu_seconds: float = 0.0
+    db_calls: int = 0
+    db_acquires: int = 0
+    api_calls: int = 0
+    latencies: dict[str, list[float]] = field(default_factory=dict)
+
+    def report(self) -> str:
+        per_update = max(self.updates, 1)
+        lines = [
+            f"scenario            {self.scenario}",
+            f"updates             {self.updates}",
+            f"wall time           {self.wall_seconds:.2f} s",
+            f"throughput          {self.updates / self.wall_seconds:.1f} updates/s",
+            f"cpu per update      {self.cpu_seconds / per_update * 1000:.3f} ms",
+            f"db calls/update     {self.db_calls / per_update:.2f}",
+            f"db acquires/update  {self.db_acquires / per_update:.2f}",
+            f"api calls/update    {self.api_calls / per_update:.2f}",
+        ]
+        for kind, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            p50 = statistics.median(values) * 1000
+            p99 = values[min(len(values) - 1, int(len(values) * 0.99))] * 1000
+            lines.append(f"{kind:<20}p50 {p50:.2f} ms  p99 {p99:.2f} ms  (n={len(values)})")
+        return "\n".join(lines)
+
+
+class Measurement:
+    def __init__(self, scenario: str, session: FakeSession):
+        self.result = Result(scenario)
+        self.session = session
+
+    def __enter__(self) -> "Measurement":
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        self._db_calls = db_query_seconds.total()
+        self._db_acquires = db_pool_acquire_seconds.total()
+        self._api_calls = self.session.total_calls()
+        return self
+
+    def __exit__(self, *exc: Any):
+        self.result.wall_seconds = time.perf_counter() - self._wall
+        self.result.cpu_seconds = time.process_time() - self._cpu
+        self.result.db_calls = db_query_seconds.total() - self._db_calls
+        self.result.db_acquires = db_pool_acquire_seconds.total() - self._db_acquires
+        self.result.api_calls = self.session.total_calls() - self._api_calls
+
+    async def feed(self, dp: Dispatcher, bot: Bot, update: Update, kind: str):
+        started = time.perf_counter()
+        await dp.feed_update(bot, update)
+        self.result.latencies.setdefault(kind, []).append(time.perf_counter() - started)
+        self.result.updates += 1
+
+
+def user_message(user_id: int, message_id: int, text: str) -> Update:
+    return Update.model_validate({
+        "update_id": next(_update_ids),
+        "message": {
+            "message_id": message_id,
+            "date": int(datetime.now().timestamp()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"User {user_id}"},
+            "text": text,
+        },
+    })
+
+
+def admin_message(text: str, reply_to: int | None = None) -> Update:
+    admin = {"id": settings.admin_id, "is_bot": False, "first_name": "Admin"}
+    chat = {"id": settings.admin_id, "type": "private"}
+    message: dict[str, Any] = {
+        "message_id": next(_update_ids),
+        "date": int(datetime.now().timestamp()),
+        "chat": chat,
+        "from": admin,
+        "text": text,
+    }
+    if reply_to is not None:
+        message["reply_to_message"] = {
+            "message_id": reply_to,
+            "date": int(datetime.now().timestamp()),
+            "chat": chat,
+        }
+    return Update.model_validate({"update_id": next(_update_ids), "message": message})
+
+
+async def settle():
+    await bursts.wait_idle()
+    await user_cache.flush()
+    await outbox.drain()
+
+
+async def send_user_burst(m: Measurement, dp: Dispatcher, bot: Bot, users: int, messages: int, offset: int = 0):
+    # Tasks are created in message order so per-user ordering matches a real polling loop
+    await asyncio.gather(*(
+        m.feed(dp, bot, user_message(FIRST_USER_ID + offset + user, message + 1, f"message {message}"), "user_message")
+        for message in range(messages)
+        for user in range(users)
+    ))
+
+
+async def user_burst(dp: Dispatcher, bot: Bot, session: FakeSession, args) -> Result:
+    with Measurement("user-burst", session) as m:
+        await send_user_burst(m, dp, bot, args.users, args.messages)
+        await settle()
+    return m.result
+
+
+async def admin_reply_storm(dp: Dispatcher, bot: Bot, session: FakeSession, args) -> Result:
+    offset = args.users
+    setup = Measurement("setup", session)
+    await send_user_burst(setup, dp, bot, args.users, 1, offset)
+    await settle()
+
+    targets = [
+        admin_message_id
+        for (chat_id, _), admin_message_id in session.forwarded.items()
+        if FIRST_USER_ID + offset <= chat_id < FIRST_USER_ID + offset + args.users
+    ]
+    with Measurement("admin-reply-storm", session) as m:
+        await asyncio.gather(*(
+            m.feed(dp, bot, admin_message(f"reply {i}", reply_to=target), "admin_reply")
+            for i in range(args.messages)
+            for target in targets
+        ))
+        await settle()
+    return m.result
+
+
+async def stats_under_load(dp: Dispatcher, bot: Bot, session: FakeSession, args) -> Result:
+    async def stats_requests(m: Measurement):
+        for _ in range(args.stats_requests):
+            await m.feed(dp, bot, admin_message("/stats 30d"), "stats")
+            await asyncio.sleep(0.01)
+
+    with Measurement("stats-under-load", session) as m:
+        await asyncio.gather(
+            send_user_burst(m, dp, bot, args.users, args.messages, offset=2 * args.users),
+            stats_requests(m),
+        )
+        await settle()
+    return m.result
+
+
+SCENARIOS = {
+    "user-burst": user_burst,
+    "admin-reply-storm": admin_reply_storm,
+    "stats-under-load": stats_under_load,
+}
+
+
+async def reset_tables():
+    async with db.acquire() as conn:
+        await conn.execute(
+            "TRUNCATE users, tickets, messages, first_response, daily_message_counts, outbox, broadcasts RESTART IDENTITY CASCADE"
+        )
@@ -0,0 +1,97 @@
+import asyncio
+import logging
+import time
+
+import asyncpg
+
+from config import settings
+from database import db
+from user_cache import user_cache
+
+logger = logging.getLogger(__name__)
+
+
+class BlockedUsers:
+    def __init__(self):
+        self._ids: set[int] = set()
+        self._notified_at: dict[int, float] = {}
+        self._reload_task: asyncio.Task | None = None
+        self._dirty = False
+        # Changes seen while a reload is loading its snapshot, replayed onto it
+        self._changes_during_reload: dict[int, bool] | None = None
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._ids
+
+    async def start(self):
+        # Subscribe first so nothing committed before the snapshot is missed
+        await db.listen("blocked_users", self._on_notify)
+        await self.reload()
+
+    async def reload(self):
+        self._changes_during_reload = changes = {}
+        try:
+            ids = set(await db.get_blocked_user_ids())
+        finally:
+            self._changes_during_reload = None
+        for user_id, is_blocked in changes.items():
+            if is_blocked:
+                ids.add(user_id)
+            else:
+                ids.discard(user_id)
+        self._ids = ids
+
+    async def block(self, user_id: int) -> bool:
+        success = await db.block_user(user_id)
+        if success:
+            self._set(user_id, True)
+        return success
+
+    async def unblock(self, user_id: int) -> bool:
+        success = await db.unblock_user(user_id)
+        if success:
+            self._set(user_id, False)
+        return success
+
+    def should_notify(self, user_id: int) -> bool:
+        if settings.blocked_notice_cooldown <= 0:
+            return False
+        now = time.monotonic()
+        last = self._notified_at.get(user_id)
+        if last is not None and now - last < settings.blocked_notice_cooldown:
+            return False
+        self._notified_at[user_id] = now
+        return True
+
+    def _set(self, user_id: int, is_blocked: bool):
+        if self._changes_during_reload is not None:
+            self._changes_during_reload[user_id] = is_blocked
+        if is_blocked:
+            self._ids.add(user_id)
+        else:
+            self._ids.discard(user_id)
+            self._notified_at.pop(user_id, None)
+        user_cache.set_blocked(user_id, is_blocked)
+
+    def _on_notify(self, conn: asyncpg.Connection, pid: int, channel: str, payload: str):
+        # Payload is "<user_id>:<t|f>"; an empty payload asks for a full resync
+        if payload:
+            user_id, is_blocked = payload.split(":")
+            self._set(int(user_id), is_blocked == "t")
+            return
+        # A resync requested during a running reload needs one more pass
+        self._dirty = True
+        if self._reload_task and not self._reload_task.done():
+            return
+        self._reload_task = asyncio.create_task(self._reload_logged())
+
+    async def _reload_logged(self):
+        while self._dirty:
+            self._dirty = False
+            try:
+                await self.reload()
+            except Exception:
+                logger.exception("Failed to reload blocked users")
+
+
+blocked_users = BlockedUsers()
@@ -0,0 +1,167 @@
+import asyncio
+import logging
+import time
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+
+from config import settings
+from database import DatabaseUnavailable, db
+from models import Broadcast
+from outbound import Priority, priority
+from ratelimit import TokenBucket
+from utils import format_broadcast_status
+
+logger = logging.getLogger(__name__)
+
+SENT, FAILED, BOT_BLOCKED = "sent", "failed", "bot_blocked"
+
+
+# Sends a broadcast page by page in user id order. Progress is checkpointed
+# after every page under a lease, so after a restart the instance that claims
+# the broadcast resends at most one page.
+class Broadcaster:
+    def __init__(self):
+        self._bot: Bot | None = None
+        self._bucket = TokenBucket(settings.broadcast_rate, settings.broadcast_rate)
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._current: Broadcast | None = None
+        self._closing = False
+
+    async def start(self, bot: Bot):
+        self._bot = bot
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if not self._task:
+            return
+        self._closing = True
+        self._wakeup.set()
+        try:
+            # The page in flight gets a chance to finish and checkpoint
+            await asyncio.wait_for(self._task, settings.outbox_drain_timeout)
+        except TimeoutError:
+            logger.warning("Broadcast page still in flight at shutdown, it will be resent")
+        self._task = None
+        if self._current:
+            try:
+                await db.release_broadcast(self._current.id)
+            except DatabaseUnavailable:
+                pass
+
+    async def begin(
+        self,
+        status_message_id: int,
+        text: str | None = None,
+        from_chat_id: int | None = None,
+        from_message_id: int | None = None,
+    ) -> Broadcast | None:
+        broadcast = await db.create_broadcast(text, from_chat_id, from_message_id, status_message_id)
+        if broadcast:
+            self._wakeup.set()
+        return broadcast
+
+    async def stop(self) -> Broadcast | None:
+        # The sending instance notices at its next checkpoint
+        return await db.finish_broadcast(None, "cancelled")
+
+    async def _run(self):
+        while not self._closing:
+            broadcast = None
+            try:
+                broadcast = await db.claim_broadcast(settings.broadcast_lease)
+                if broadcast:
+                    self._current = broadcast
+                    await self._deliver(broadcast)
+                    if broadcast.status == "running":
+                        # Interrupted by shutdown; the next start can resume right away
+                        await db.release_broadcast(broadcast.id)
+            except DatabaseUnavailable:
+                pass
+            except Exception:
+                logger.exception("Broadcast failed")
+            self._current = None
+            if broadcast:
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), settings.broadcast_poll_interval)
+            except TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def _deliver(self, broadcast: Broadcast):
+        logger.info("Broadcast %s running from user %s", broadcast.id, broadcast.last_user_id)
+        started = time.monotonic()
+        sent_before = broadcast.sent + broadcast.failed + broadcast.bot_blocked
+        last_progress = started
+
+        while not self._closing:
+            user_ids = await db.broadcast_recipients(broadcast.last_user_id, settings.broadcast_batch_size)
+            if not user_ids:
+                finished = await db.finish_broadcast(broadcast.id, "done")
+                # Nothing to finish if it was stopped after the last checkpoint
+                broadcast.status = "done" if finished else "cancelled"
+                break
+
+            results = await asyncio.gather(*(self._send(broadcast, user_id) for user_id in user_ids))
+            bot_blocked_ids = [user_id for user_id, result in zip(user_ids, results) if result == BOT_BLOCKED]
+            sent = results.count(SENT)
+            failed = results.count(FAILED)
+            status = await db.checkpoint_broadcast(
+                broadcast.id, user_ids[-1], sent, failed, bot_blocked_ids, settings.broadcast_lease
+            )
+            broadcast.last_user_id = user_ids[-1]
+            broadcast.sent += sent
+            broadcast.failed += failed
+            broadcast.bot_blocked += len(bot_blocked_ids)
+            broadcast.status = status
+            if status != "running":
+                break
+
+            now = time.monotonic()
+            if now - last_progress >= settings.broadcast_progress_interval:
+                last_progress = now
+                processed = broadcast.sent + broadcast.failed + broadcast.bot_blocked - sent_before
+                await self._report(broadcast, processed / (now - started))
+
+        if broadcast.status != "running":
+            logger.info(
+                "Broadcast %s %s: %s sent, %s failed, %s blocked the bot",
+                broadcast.id, broadcast.status, broadcast.sent, broadcast.failed, broadcast.bot_blocked,
+            )
+            await self._report(broadcast)
+
+    async def _send(self, broadcast: Broadcast, user_id: int) -> str:
+        await self._bucket.acquire()
+        try:
+            # Replies and admin notices overtake broadcast sends in the outbound scheduler
+            with priority(Priority.BULK):
+                if broadcast.from_message_id is not None:
+                    await self._bot.copy_message(user_id, broadcast.from_chat_id, broadcast.from_message_id)
+                else:
+                    await self._bot.send_message(user_id, broadcast.text)
+        except TelegramForbiddenError:
+            return BOT_BLOCKED
+        except Exception as e:
+            logger.debug("Broadcast %s to %s failed: %s", broadcast.id, user_id, e)
+            return FAILED
+        return SENT
+
+    async def _report(self, broadcast: Broadcast, rate: float | None = None):
+        if broadcast.status_message_id is None:
+            return
+        try:
+            await self._bot.edit_message_text(
+                format_broadcast_status(broadcast, rate),
+                chat_id=settings.admin_id,
+                message_id=broadcast.status_message_id,
+            )
+        except TelegramBadRequest:
+            # Unchanged text, or the status message was deleted
+            pass
+        except Exception:
+            logger.exception("Failed to update broadcast %s status", broadcast.id)
+
+
+broadcaster = Broadcaster()
@@ -0,0 +1,41 @@
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+# Opens after `threshold` consecutive failures and rejects calls for `cooldown`
+# seconds; the first call after that is a probe, one more failure reopens it.
+class CircuitBreaker:
+    def __init__(self, name: str, threshold: int, cooldown: float):
+        self.name = name
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self._open_until = 0.0
+
+    @property
+    def is_open(self) -> bool:
+        return time.monotonic() < self._open_until
+
+    def allow(self) -> bool:
+        return not self.is_open
+
+    def record_success(self):
+        if self.failures >= self.threshold:
+            logger.info("%s circuit closed", self.name)
+        self.failures = 0
+
+    def reset(self):
+        if self.failures >= self.threshold:
+            logger.info("%s circuit reset", self.name)
+        self.failures = 0
+        self._open_until = 0.0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures < self.threshold:
+            return
+        if self.failures == self.threshold:
+            logger.warning("%s circuit opened after %d failures", self.name, self.failures)
+        self._open_until = time.monotonic() + self.cooldown
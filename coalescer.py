@@ -0,0 +1,86 @@
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable
+
+from aiogram import Bot
+from aiogram.types import Message
+
+from config import settings
+from middleware import user_locks
+from models import User
+from tracing import trace
+
+logger = logging.getLogger(__name__)
+
+DeliverBurst = Callable[[Bot, User, list[Message]], Awaitable[None]]
+
+
+@dataclass
+class Burst:
+    bot: Bot
+    db_user: User
+    messages: list[Message] = field(default_factory=list)
+    started_at: float = 0.0
+    last_at: float = 0.0
+    # Album of the last message; its parts may still be arriving
+    media_group_id: str | None = None
+
+
+class BurstCoalescer:
+    def __init__(self, deliver: DeliverBurst):
+        self._deliver = deliver
+        self._bursts: dict[int, Burst] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self._closing = asyncio.Event()
+
+    def add(self, message: Message, bot: Bot, db_user: User):
+        now = asyncio.get_running_loop().time()
+        burst = self._bursts.get(db_user.id)
+        if burst is None:
+            burst = Burst(bot=bot, db_user=db_user, started_at=now)
+            self._bursts[db_user.id] = burst
+            task = asyncio.create_task(self._flush_later(db_user.id))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+        burst.db_user = db_user
+        burst.messages.append(message)
+        burst.last_at = now
+        burst.media_group_id = message.media_group_id
+
+    async def wait_idle(self):
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+    async def close(self):
+        self._closing.set()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _flush_later(self, user_id: int):
+        burst = self._bursts[user_id]
+        loop = asyncio.get_running_loop()
+        # Debounce: wait for a quiet window, but never longer than burst_max_delay
+        # unless an album is still arriving, so it is not split over two cards
+        while not self._closing.is_set():
+            deadline = burst.last_at + settings.burst_window
+            if burst.media_group_id is None:
+                deadline = min(deadline, burst.started_at + settings.burst_max_delay)
+            delay = deadline - loop.time()
+            if delay <= 0:
+                break
+            try:
+                await asyncio.wait_for(self._closing.wait(), delay)
+            except TimeoutError:
+                pass
+
+        del self._bursts[user_id]
+        # Same lock as UserSequencingMiddleware, so bursts of one user are delivered in order
+        async with user_locks.hold(user_id):
+            try:
+                with trace("burst", user_id=user_id, messages=len(burst.messages)):
+                    await self._deliver(burst.bot, burst.db_user, burst.messages)
+            except Exception:
+                logger.exception(
+                    "Failed to deliver %d messages from user %d", len(burst.messages), user_id
+                )
@@ -12,6 +12,95 @@ class Settings(BaseSettings):
     db_user: str = "postgres"
     db_password: str = "postgres"
     db_name: str = "bovpn_support"
+    db_validate_rows: bool = False
+    db_pool_min_size: int = 2
+    db_pool_max_size: int = 10
+    db_statement_cache_size: int = 100
+
+    # Reports and lookups; without a DSN the read pool is a separate pool on the primary
+    db_read_dsn: str | None = None
+    db_read_pool_min_size: int = 1
+    db_read_pool_max_size: int = 4
+    db_replica_max_lag: float = 10.0
+    db_replica_lag_interval: float = 5.0
+    db_acquire_timeout: float = 5.0
+    db_command_timeout: float = 60.0
+    db_breaker_threshold: int = 3
+    db_breaker_cooldown: float = 5.0
+
+    # Schema migrations give up on a busy table after the timeout and retry
+    migration_lock_timeout: float = 5.0
+    migration_lock_retries: int = 5
+
+    # Monthly messages partitions; retention 0 keeps every month online
+    partition_months_ahead: int = 3
+    partition_maintenance_interval: float = 6 * 3600.0
+    partition_archive_timeout: float = 3600.0
+    partition_detach_lock_timeout: float = 2.0
+    message_retention_months: int = 0
+    archive_dir: str = "archive"
+
+    export_dir: str = "exports"
+    export_batch_size: int = 5000
+    # Telegram rejects bot uploads over 50 MB; bigger exports stay in export_dir
+    export_max_upload: int = 50 * 1024 * 1024
+
+    spool_path: str = "spool.jsonl"
+    spool_replay_interval: float = 5.0
+
+    user_cache_size: int = 10000
+    user_flush_interval: float = 1.0
+    user_flush_batch_size: int = 200
+
+    admin_index_size: int = 50000
+
+    blocked_notice_cooldown: float = 3600.0
+
+    throttle_rate: float = 0.5
+    throttle_burst: int = 10
+    throttle_summary_delay: float = 10.0
+
+    outbox_poll_interval: float = 1.0
+    outbox_batch_size: int = 100
+    outbox_lease: float = 60.0
+    outbox_max_attempts: int = 8
+    outbox_backoff_base: float = 2.0
+    outbox_backoff_max: float = 300.0
+    outbox_drain_timeout: float = 10.0
+
+    # Broadcasts stay below send_global_rate so replies keep some headroom
+    broadcast_rate: float = 25.0
+    broadcast_batch_size: int = 100
+    broadcast_lease: float = 60.0
+    broadcast_poll_interval: float = 5.0
+    broadcast_progress_interval: float = 5.0
+
+    send_global_rate: float = 30.0
+    send_global_burst: int = 30
+    send_chat_rate: float = 1.0
+    send_chat_burst: int = 3
+    send_max_retries: int = 3
+
+    burst_window: float = 1.0
+    burst_max_delay: float = 5.0
+
+    metrics_host: str = "127.0.0.1"
+    metrics_port: int = 9100
+
+    trace_slow_ms: float = 1000.0
+    trace_file: str | None = None
+    trace_sample_rate: float = 0.01
+
+    webhook_enabled: bool = False
+    webhook_url: str | None = None
+    webhook_path: str = "/webhook"
+    webhook_secret: str | None = None
+    webhook_host: str = "0.0.0.0"
+    webhook_port: int = 8080
+    webhook_workers: int = 16
+    webhook_queue_size: int = 1000
+    webhook_enqueue_timeout: float = 5.0
+    webhook_drain_timeout: float = 10.0
 
     @property
     def database_url(self) -> str:
@@ -1,78 +1,321 @@
-import asyncpg
+import asyncio
+import gzip
+import logging
+import re
+import time
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
+from dataclasses import fields
+from pathlib import Path
+from typing import Callable, TypeVar
+
+import asyncpg
+from pydantic import TypeAdapter
 
+from circuit import CircuitBreaker
 from config import settings
-from models import User, Ticket, Message, QuickReply, UserStats, Stats
+from message_index import AdminMessageRef, admin_messages
+from metrics import Gauge, db_pool_acquire_seconds, instrument
+from tracing import record_span
+from models import User, Ticket, QuickReply, OutboxItem, Broadcast, UserStats, Stats
+
+logger = logging.getLogger(__name__)
+
+NotifyCallback = Callable[[asyncpg.Connection, int, str, str], None]
+
+RowT = TypeVar("RowT", User, Ticket, QuickReply, OutboxItem, Broadcast)
+
+# Errors that mean the server is unreachable rather than that a query was
+# wrong, when raised while connecting or on a connection that is now closed
+CONNECTION_ERRORS = (
+    OSError,
+    asyncpg.PostgresConnectionError,
+    asyncpg.OperatorInterventionError,
+)
+
+
+class DatabaseUnavailable(Exception):
+    pass
+
+
+# The server is reachable but every pool connection stayed busy for
+# db_acquire_timeout; never counted by the circuit breaker
+class DatabaseBusy(DatabaseUnavailable):
+    pass
+
+
+def _connection_lost(conn: asyncpg.Connection) -> bool:
+    try:
+        return conn.is_closed()
+    except asyncpg.InterfaceError:
+        # The pool already detached the proxy from its dead connection
+        return True
+
+_row_fields: dict[type, tuple[str, ...]] = {}
+_row_adapters: dict[type, TypeAdapter] = {}
+
+
+def from_row(cls: type[RowT], row: asyncpg.Record) -> RowT:
+    if settings.db_validate_rows:
+        adapter = _row_adapters.get(cls) or _row_adapters.setdefault(cls, TypeAdapter(cls))
+        return adapter.validate_python(dict(row))
 
+    names = _row_fields.get(cls)
+    if names is None:
+        names = _row_fields[cls] = tuple(field.name for field in fields(cls))
+    return cls(*map(row.__getitem__, names))
 
+PARTITION_UPPER_BOUND = re.compile(r"TO \('([^']+)'\)")
+
+# $1 and $2 bound the export range, start inclusive
+EXPORT_QUERIES = {
+    "tickets": "SELECT * FROM tickets WHERE created_at >= $1 AND created_at < $2 ORDER BY id",
+    # Left in partition order, which is close to created_at order; sorting
+    # millions of rows is up to the consumer
+    "messages": "SELECT * FROM messages WHERE created_at >= $1 AND created_at < $2",
+    # Users who wrote at some point during the range
+    "users": "SELECT * FROM users WHERE created_at < $2 AND last_message_at >= $1 ORDER BY id",
+}
+
+RESPONSE_BUCKETS = [
+    ("до 5 мин", "responses_5m"),
+    ("5–30 мин", "responses_30m"),
+    ("30 мин – 2 ч", "responses_2h"),
+    ("от 2 ч", "responses_over_2h"),
+]
+
+
+@instrument
 class Database:
     def __init__(self):
         self.pool: asyncpg.Pool | None = None
+        self.read_pool: asyncpg.Pool | None = None
+        self.acquire_waiters = 0
+        self.replica_lag: float | None = None
+        self._lag_task: asyncio.Task | None = None
+        self._listen_conn: asyncpg.Connection | None = None
+        self._listeners: dict[str, NotifyCallback] = {}
+        self._closing = False
+        self.breaker = CircuitBreaker("database", settings.db_breaker_threshold, settings.db_breaker_cooldown)
 
     async def connect(self):
         self.pool = await asyncpg.create_pool(
-            host=settings.db_host,
-            port=settings.db_port,
-            user=settings.db_user,
-            password=settings.db_password,
-            database=settings.db_name,
-            min_size=2,
-            max_size=10,
+            **self._connect_args(),
+            min_size=settings.db_pool_min_size,
+            max_size=settings.db_pool_max_size,
+            command_timeout=settings.db_command_timeout,
+            statement_cache_size=settings.db_statement_cache_size,
         )
+        # Reports get their own connections so they never queue ahead of ingest
+        if settings.db_read_dsn:
+            await self._open_replica_pool()
+            self._lag_task = asyncio.create_task(self._watch_replica_lag())
+        else:
+            self.read_pool = await self._create_read_pool(self._connect_args())
+            self.replica_lag = 0.0
+
+    async def _create_read_pool(self, target: dict) -> asyncpg.Pool:
+        return await asyncpg.create_pool(
+            **target,
+            min_size=settings.db_read_pool_min_size,
+            max_size=settings.db_read_pool_max_size,
+            command_timeout=settings.db_command_timeout,
+            statement_cache_size=settings.db_statement_cache_size,
+        )
+
+    async def _open_replica_pool(self):
+        try:
+            self.read_pool = await self._create_read_pool({"dsn": settings.db_read_dsn})
+        except (*CONNECTION_ERRORS, asyncpg.PostgresError) as e:
+            logger.warning("Read replica unavailable, reading from primary: %s", e)
+            return
+        await self._check_replica_lag()
+
+    def _connect_args(self) -> dict:
+        return {
+            "host": settings.db_host,
+            "port": settings.db_port,
+            "user": settings.db_user,
+            "password": settings.db_password,
+            "database": settings.db_name,
+        }
 
     async def disconnect(self):
+        self._closing = True
+        if self._lag_task:
+            self._lag_task.cancel()
+        if self._listen_conn:
+            await self._listen_conn.close()
+        if self.read_pool:
+            await self.read_pool.close()
         if self.pool:
             await self.pool.close()
 
-    async def init_tables(self):
-        async with self.pool.acquire() as conn:
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    id BIGINT PRIMARY KEY,
-                    username VARCHAR(255),
-                    first_name VARCHAR(255),
-                    last_name VARCHAR(255),
-                    is_blocked BOOLEAN DEFAULT FALSE,
-                    created_at TIMESTAMP DEFAULT NOW(),
-                    last_message_at TIMESTAMP
-                );
-
-                CREATE TABLE IF NOT EXISTS tickets (
-                    id SERIAL PRIMARY KEY,
-                    user_id BIGINT REFERENCES users(id),
-                    status VARCHAR(20) DEFAULT 'open',
-                    created_at TIMESTAMP DEFAULT NOW(),
-                    closed_at TIMESTAMP
-                );
-
-                CREATE TABLE IF NOT EXISTS messages (
-                    id SERIAL PRIMARY KEY,
-                    ticket_id INT REFERENCES tickets(id),
-                    user_id BIGINT REFERENCES users(id),
-                    user_message_id BIGINT,
-                    admin_message_id BIGINT,
-                    direction VARCHAR(10),
-                    created_at TIMESTAMP DEFAULT NOW()
-                );
-
-                CREATE TABLE IF NOT EXISTS quick_replies (
-                    id SERIAL PRIMARY KEY,
-                    shortcut VARCHAR(50) UNIQUE,
-                    text TEXT
-                );
-
-                CREATE INDEX IF NOT EXISTS idx_messages_admin_message_id ON messages(admin_message_id);
-                CREATE INDEX IF NOT EXISTS idx_messages_ticket_id ON messages(ticket_id);
-                CREATE INDEX IF NOT EXISTS idx_tickets_user_id ON tickets(user_id);
-            """)
+    async def _check_replica_lag(self):
+        try:
+            async with self.read_pool.acquire(timeout=settings.db_acquire_timeout) as conn:
+                self.replica_lag = await conn.fetchval(
+                    """
+                    SELECT CASE
+                        WHEN NOT pg_is_in_recovery() THEN 0
+                        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                        ELSE COALESCE(EXTRACT(EPOCH FROM NOW() - pg_last_xact_replay_timestamp()), 0)
+                    END::float8
+                    """
+                )
+        except (*CONNECTION_ERRORS, asyncpg.PostgresError) as e:
+            if self.replica_lag is not None:
+                logger.warning("Read replica unavailable, reading from primary: %s", e)
+            self.replica_lag = None
+
+    async def _watch_replica_lag(self):
+        while True:
+            await asyncio.sleep(settings.db_replica_lag_interval)
+            if self.read_pool is None:
+                await self._open_replica_pool()
+            else:
+                await self._check_replica_lag()
+
+    def _read_pool(self) -> asyncpg.Pool:
+        # Fall back to primary while the replica is down or too far behind
+        lag = self.replica_lag
+        if self.read_pool is None or lag is None or lag > settings.db_replica_max_lag:
+            return self.pool
+        return self.read_pool
+
+    @asynccontextmanager
+    async def acquire(self, read: bool = False) -> AsyncIterator[asyncpg.Connection]:
+        pool = self._read_pool() if read else self.pool
+        if pool is self.read_pool:
+            if not settings.db_read_dsn and not self.breaker.allow():
+                raise DatabaseUnavailable("circuit open")
+            # Read pool failures never open the primary's breaker
+            async with self._acquire_replica() as conn:
+                yield conn
+            return
+
+        if not self.breaker.allow():
+            raise DatabaseUnavailable("circuit open")
+
+        self.acquire_waiters += 1
+        started = time.perf_counter()
+        try:
+            conn = await pool.acquire(timeout=settings.db_acquire_timeout)
+        except TimeoutError as e:
+            # A full pool means the server is up but every connection is busy;
+            # only a timeout while opening a new connection counts as an outage
+            if pool.get_size() >= pool.get_max_size():
+                raise DatabaseBusy("no free pool connection") from e
+            self.breaker.record_failure()
+            raise DatabaseUnavailable("connect timed out") from e
+        except CONNECTION_ERRORS as e:
+            self.breaker.record_failure()
+            raise DatabaseUnavailable(str(e) or type(e).__name__) from e
+        finally:
+            self.acquire_waiters -= 1
+
+        acquired = time.perf_counter()
+        db_pool_acquire_seconds.observe(acquired - started, "write")
+        record_span("db.pool_acquire", started, acquired)
+        try:
+            yield conn
+        except CONNECTION_ERRORS as e:
+            # Statement timeouts and the caller's own errors leave the
+            # connection open; only a lost connection is the server's fault
+            if not _connection_lost(conn):
+                raise
+            self.breaker.record_failure()
+            raise DatabaseUnavailable(str(e) or type(e).__name__) from e
+        else:
+            self.breaker.record_success()
+        finally:
+            await pool.release(conn)
+
+    @asynccontextmanager
+    async def _acquire_replica(self) -> AsyncIterator[asyncpg.Connection]:
+        started = time.perf_counter()
+        try:
+            conn = await self.read_pool.acquire(timeout=settings.db_acquire_timeout)
+        except TimeoutError as e:
+            if self.read_pool.get_size() >= self.read_pool.get_max_size():
+                raise DatabaseBusy("no free read pool connection") from e
+            self._replica_failed()
+            raise DatabaseUnavailable("connect timed out") from e
+        except CONNECTION_ERRORS as e:
+            self._replica_failed()
+            raise DatabaseUnavailable(str(e) or type(e).__name__) from e
+
+        acquired = time.perf_counter()
+        db_pool_acquire_seconds.observe(acquired - started, "read")
+        record_span("db.pool_acquire", started, acquired, pool="read")
+        try:
+            yield conn
+        except CONNECTION_ERRORS as e:
+            if not _connection_lost(conn):
+                raise
+            self._replica_failed()
+            raise DatabaseUnavailable(str(e) or type(e).__name__) from e
+        finally:
+            await self.read_pool.release(conn)
+
+    def _replica_failed(self):
+        if settings.db_read_dsn:
+            # Route reads to primary until the next lag check sees the replica again
+            self.replica_lag = None
+
+    # LISTEN/NOTIFY runs on a dedicated connection outside the pool
+    async def listen(self, channel: str, callback: NotifyCallback):
+        self._listeners[channel] = callback
+        if self._listen_conn is None:
+            self._listen_conn = await self._open_listen_connection()
+        await self._listen_conn.add_listener(channel, callback)
+
+    async def _open_listen_connection(self) -> asyncpg.Connection:
+        conn = await asyncpg.connect(**self._connect_args())
+        conn.add_termination_listener(self._on_listen_terminated)
+        return conn
+
+    def _on_listen_terminated(self, conn: asyncpg.Connection):
+        self._listen_conn = None
+        if not self._closing:
+            logger.warning("LISTEN connection lost, reconnecting")
+            asyncio.get_running_loop().create_task(self._relisten())
+
+    async def _relisten(self):
+        while not self._closing:
+            try:
+                conn = await self._open_listen_connection()
+                for channel, callback in self._listeners.items():
+                    await conn.add_listener(channel, callback)
+            except (OSError, asyncpg.PostgresError):
+                await asyncio.sleep(5)
+                continue
+            self._listen_conn = conn
+            # The server is reachable again; no need to wait out the breaker cooldown
+            self.breaker.reset()
+            # Notifications may have been missed while disconnected
+            for channel, callback in self._listeners.items():
+                callback(conn, 0, channel, "")
+            return
+
+    # A connection outside the pools, without the statement timeout, for long
+    # running work such as schema migrations and exports
+    async def open_connection(self, read: bool = False) -> asyncpg.Connection:
+        if read and settings.db_read_dsn:
+            try:
+                return await asyncpg.connect(dsn=settings.db_read_dsn)
+            except CONNECTION_ERRORS as e:
+                logger.warning("Read replica unavailable, using primary: %s", e)
+        return await asyncpg.connect(**self._connect_args())
 
     # User operations
     async def get_user(self, user_id: int) -> User | None:
-        async with self.pool.acquire() as conn:
+        async with self.acquire(read=True) as conn:
             row = await conn.fetchrow(
                 "SELECT * FROM users WHERE id = $1", user_id
             )
-            return User(**dict(row)) if row else None
+            return from_row(User, row) if row else None
 
     async def upsert_user(
         self,
@@ -81,7 +324,7 @@ class Database:
         first_name: str | None,
         last_name: str | None,
     ) -> User:
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             row = await conn.fetchrow(
                 """
                 INSERT INTO users (id, username, first_name, last_name, last_message_at)
@@ -90,7 +333,8 @@ class Database:
                     username = EXCLUDED.username,
                     first_name = EXCLUDED.first_name,
                     last_name = EXCLUDED.last_name,
-                    last_message_at = NOW()
+                    last_message_at = NOW(),
+                    bot_blocked = FALSE
                 RETURNING *
                 """,
                 user_id,
@@ -98,123 +342,510 @@ class Database:
                 first_name,
                 last_name,
             )
-            return User(**dict(row))
+            return from_row(User, row)
+
+    async def upsert_users(
+        self,
+        rows: list[tuple[int, str | None, str | None, str | None, datetime]],
+    ):
+        ids, usernames, first_names, last_names, last_message_ats = zip(*rows)
+        async with self.acquire() as conn:
+            await conn.execute(
+                """
+                INSERT INTO users (id, username, first_name, last_name, last_message_at)
+                SELECT * FROM unnest(
+                    $1::bigint[], $2::varchar[], $3::varchar[], $4::varchar[], $5::timestamp[]
+                )
+                ON CONFLICT (id) DO UPDATE SET
+                    username = EXCLUDED.username,
+                    first_name = EXCLUDED.first_name,
+                    last_name = EXCLUDED.last_name,
+                    last_message_at = GREATEST(users.last_message_at, EXCLUDED.last_message_at),
+                    bot_blocked = FALSE
+                """,
+                list(ids),
+                list(usernames),
+                list(first_names),
+                list(last_names),
+                list(last_message_ats),
+            )
 
     async def block_user(self, user_id: int) -> bool:
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             result = await conn.execute(
                 "UPDATE users SET is_blocked = TRUE WHERE id = $1", user_id
             )
             return result == "UPDATE 1"
 
     async def unblock_user(self, user_id: int) -> bool:
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             result = await conn.execute(
                 "UPDATE users SET is_blocked = FALSE WHERE id = $1", user_id
             )
             return result == "UPDATE 1"
 
+    async def get_blocked_user_ids(self) -> list[int]:
+        async with self.acquire() as conn:
+            rows = await conn.fetch("SELECT id FROM users WHERE is_blocked")
+            return [row["id"] for row in rows]
+
     async def get_user_stats(self, user_id: int) -> UserStats:
-        async with self.pool.acquire() as conn:
-            message_count = await conn.fetchval(
-                "SELECT COUNT(*) FROM messages WHERE user_id = $1", user_id
-            )
-            ticket_count = await conn.fetchval(
-                "SELECT COUNT(*) FROM tickets WHERE user_id = $1", user_id
-            )
-            return UserStats(
-                message_count=message_count or 0,
-                ticket_count=ticket_count or 0,
+        async with self.acquire(read=True) as conn:
+            row = await conn.fetchrow(
+                "SELECT message_count, ticket_count FROM users WHERE id = $1", user_id
             )
+            return UserStats(**dict(row)) if row else UserStats()
 
     # Ticket operations
     async def get_open_ticket(self, user_id: int) -> Ticket | None:
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             row = await conn.fetchrow(
                 "SELECT * FROM tickets WHERE user_id = $1 AND status = 'open' ORDER BY created_at DESC LIMIT 1",
                 user_id,
             )
-            return Ticket(**dict(row)) if row else None
-
-    async def create_ticket(self, user_id: int) -> Ticket:
-        async with self.pool.acquire() as conn:
-            row = await conn.fetchrow(
-                "INSERT INTO tickets (user_id) VALUES ($1) RETURNING *", user_id
-            )
-            return Ticket(**dict(row))
+            return from_row(Ticket, row) if row else None
 
     async def close_ticket(self, ticket_id: int) -> bool:
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
+            # False when it was already closed, possibly by another instance
             result = await conn.execute(
-                "UPDATE tickets SET status = 'closed', closed_at = NOW() WHERE id = $1",
+                "UPDATE tickets SET status = 'closed', closed_at = NOW() WHERE id = $1 AND status = 'open'",
                 ticket_id,
             )
             return result == "UPDATE 1"
 
-    async def get_or_create_ticket(self, user_id: int) -> Ticket:
-        ticket = await self.get_open_ticket(user_id)
-        if not ticket:
-            ticket = await self.create_ticket(user_id)
-        return ticket
+    async def ingest_incoming(self, user_id: int) -> tuple[Ticket, UserStats]:
+        async with self.acquire() as conn:
+            # A concurrent insert makes ON CONFLICT return nothing; the retry then sees that ticket
+            for _ in range(3):
+                row = await conn.fetchrow(
+                    """
+                    WITH open_ticket AS (
+                        SELECT * FROM tickets
+                        WHERE user_id = $1 AND status = 'open'
+                    ), new_ticket AS (
+                        INSERT INTO tickets (user_id)
+                        SELECT $1 WHERE NOT EXISTS (SELECT 1 FROM open_ticket)
+                        ON CONFLICT (user_id) WHERE status = 'open' DO NOTHING
+                        RETURNING *
+                    ), ticket AS (
+                        SELECT * FROM open_ticket
+                        UNION ALL
+                        SELECT * FROM new_ticket
+                    )
+                    SELECT
+                        ticket.*,
+                        u.message_count,
+                        u.ticket_count + (SELECT COUNT(*) FROM new_ticket) AS ticket_count
+                    FROM ticket
+                    JOIN users u ON u.id = $1
+                    """,
+                    user_id,
+                )
+                if row:
+                    break
+            else:
+                raise RuntimeError(f"Could not get or create an open ticket for user {user_id}")
+
+            stats = UserStats(
+                message_count=row["message_count"],
+                ticket_count=row["ticket_count"],
+            )
+            return from_row(Ticket, row), stats
 
     # Message operations
-    async def save_message(
-        self,
-        ticket_id: int,
-        user_id: int,
-        user_message_id: int | None,
-        admin_message_id: int | None,
-        direction: str,
-    ) -> Message:
-        async with self.pool.acquire() as conn:
-            row = await conn.fetchrow(
+    async def save_messages(self, rows: list[tuple[int, int, int | None, int | None, str]]):
+        ticket_ids, user_ids, user_message_ids, admin_message_ids, directions = zip(*rows)
+        async with self.acquire() as conn:
+            await conn.execute(
                 """
                 INSERT INTO messages (ticket_id, user_id, user_message_id, admin_message_id, direction)
-                VALUES ($1, $2, $3, $4, $5)
-                RETURNING *
+                SELECT * FROM unnest(
+                    $1::int[], $2::bigint[], $3::bigint[], $4::bigint[], $5::varchar[]
+                )
+                """,
+                list(ticket_ids),
+                list(user_ids),
+                list(user_message_ids),
+                list(admin_message_ids),
+                list(directions),
+            )
+        for ticket_id, user_id, _, admin_message_id, _ in rows:
+            if admin_message_id is not None:
+                admin_messages.remember(admin_message_id, AdminMessageRef(user_id, ticket_id))
+
+    async def replay_incoming(self, rows: list[tuple[int, int, int, datetime]]):
+        # rows: (user_id, user_message_id, admin_message_id, received_at) of messages
+        # forwarded while the database was down. Already stored admin ids are
+        # skipped so a replay interrupted after commit can run again.
+        user_ids, user_message_ids, admin_message_ids, received_ats = zip(*rows)
+        async with self.acquire() as conn:
+            await conn.execute(
+                """
+                WITH incoming AS (
+                    SELECT * FROM unnest($1::bigint[], $2::bigint[], $3::bigint[], $4::timestamp[])
+                        AS m(user_id, user_message_id, admin_message_id, created_at)
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM messages WHERE messages.admin_message_id = m.admin_message_id
+                    )
+                ), new_ticket AS (
+                    INSERT INTO tickets (user_id)
+                    SELECT DISTINCT user_id FROM incoming
+                    ON CONFLICT (user_id) WHERE status = 'open' DO NOTHING
+                    RETURNING id, user_id
+                ), ticket AS (
+                    SELECT id, user_id FROM tickets
+                    WHERE status = 'open' AND user_id IN (SELECT user_id FROM incoming)
+                    UNION ALL
+                    SELECT id, user_id FROM new_ticket
+                )
+                INSERT INTO messages (ticket_id, user_id, user_message_id, admin_message_id, direction, created_at)
+                SELECT ticket.id, m.user_id, m.user_message_id, m.admin_message_id, 'incoming', m.created_at
+                FROM incoming m
+                JOIN ticket USING (user_id)
+                ORDER BY m.created_at, m.admin_message_id
+                """,
+                list(user_ids),
+                list(user_message_ids),
+                list(admin_message_ids),
+                list(received_ats),
+            )
+
+    async def lookup_admin_message(self, admin_message_id: int) -> AdminMessageRef | None:
+        ref = admin_messages.get(admin_message_id)
+        if ref:
+            return ref
+
+        async with self.acquire() as conn:
+            row = await conn.fetchrow(
+                """
+                SELECT user_id, ticket_id FROM messages
+                WHERE admin_message_id = $1 AND ticket_id IS NOT NULL
+                """,
+                admin_message_id,
+            )
+        if not row:
+            return None
+        ref = AdminMessageRef(**dict(row))
+        admin_messages.remember(admin_message_id, ref)
+        return ref
+
+    async def warm_admin_messages(self, limit: int):
+        async with self.acquire(read=True) as conn:
+            rows = await conn.fetch(
+                """
+                SELECT admin_message_id, user_id, ticket_id FROM messages
+                WHERE admin_message_id IS NOT NULL AND ticket_id IS NOT NULL
+                ORDER BY id DESC
+                LIMIT $1
                 """,
+                limit,
+            )
+        # Oldest first so the most recent entries end up least likely to be evicted
+        for row in reversed(rows):
+            admin_messages.remember(
+                row["admin_message_id"],
+                AdminMessageRef(row["user_id"], row["ticket_id"]),
+            )
+
+    # Partition maintenance
+    async def create_message_partitions(self, months_ahead: int) -> int:
+        async with self.acquire() as conn:
+            return await conn.fetchval("SELECT create_message_partitions($1)", months_ahead)
+
+    async def expired_message_partitions(self, before: datetime) -> list[str]:
+        async with self.acquire() as conn:
+            rows = await conn.fetch(
+                """
+                SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) AS bound
+                FROM pg_inherits i
+                JOIN pg_class c ON c.oid = i.inhrelid
+                WHERE i.inhparent = 'messages'::regclass
+                """
+            )
+        expired = []
+        for row in rows:
+            # FOR VALUES FROM ('2024-01-01 00:00:00') TO ('2024-02-01 00:00:00')
+            match = PARTITION_UPPER_BOUND.search(row["bound"])
+            if match and datetime.fromisoformat(match.group(1)) <= before:
+                expired.append((match.group(1), row["relname"]))
+        return [name for _, name in sorted(expired)]
+
+    async def archive_message_partition(self, name: str, path: Path) -> bool:
+        # Copy out, then detach and drop in the same transaction; the advisory
+        # lock keeps two instances from archiving concurrently
+        partial = path.with_name(path.name + ".partial")
+        try:
+            async with self.acquire() as conn:
+                async with conn.transaction():
+                    locked = await conn.fetchval(
+                        "SELECT pg_try_advisory_xact_lock(hashtext('bovpn_message_partitions'))"
+                    )
+                    if not locked:
+                        return False
+                    with gzip.open(partial, "wb") as f:
+                        await conn.copy_from_table(
+                            name, output=f, format="csv", header=True, timeout=settings.partition_archive_timeout
+                        )
+                    # DETACH locks all of messages; give up rather than stall
+                    # ingest behind a long reader, and retry on the next cycle
+                    await conn.execute(
+                        f"SET LOCAL lock_timeout = {int(settings.partition_detach_lock_timeout * 1000)}"
+                    )
+                    await conn.execute(f'ALTER TABLE messages DETACH PARTITION "{name}"')
+                    await conn.execute(f'DROP TABLE "{name}"')
+                    partial.replace(path)
+        except BaseException:
+            partial.unlink(missing_ok=True)
+            raise
+        return True
+
+    # Streams rows straight into a gzip file: CSV through COPY, JSONL through a
+    # server-side cursor. A dedicated connection keeps long exports off the pool.
+    async def export_table(self, table: str, start: datetime, end: datetime, fmt: str, path: Path) -> int:
+        query = EXPORT_QUERIES[table]
+        partial = path.with_name(path.name + ".partial")
+        conn = await self.open_connection(read=True)
+        try:
+            with gzip.open(partial, "wb", compresslevel=6) as f:
+                if fmt == "csv":
+                    status = await conn.copy_from_query(query, start, end, output=f, format="csv", header=True)
+                    rows = int(status.split()[-1])
+                else:
+                    rows = 0
+                    async with conn.transaction(readonly=True):
+                        cursor = await conn.cursor(f"SELECT row_to_json(t)::text FROM ({query}) t", start, end)
+                        while batch := await cursor.fetch(settings.export_batch_size):
+                            chunk = "".join(row[0] + "\n" for row in batch).encode()
+                            await asyncio.to_thread(f.write, chunk)
+                            rows += len(batch)
+        except BaseException:
+            partial.unlink(missing_ok=True)
+            raise
+        finally:
+            await conn.close()
+        partial.replace(path)
+        return rows
+
+    # Outbox operations
+    async def enqueue_outbox(
+        self,
+        chat_id: int,
+        kind: str,
+        ticket_id: int | None = None,
+        text: str | None = None,
+        from_chat_id: int | None = None,
+        from_message_id: int | None = None,
+        admin_message_id: int | None = None,
+    ) -> int:
+        async with self.acquire() as conn:
+            return await conn.fetchval(
+                """
+                INSERT INTO outbox (chat_id, kind, ticket_id, text, from_chat_id, from_message_id, admin_message_id)
+                VALUES ($1, $2, $3, $4, $5, $6, $7)
+                RETURNING id
+                """,
+                chat_id,
+                kind,
                 ticket_id,
-                user_id,
-                user_message_id,
+                text,
+                from_chat_id,
+                from_message_id,
                 admin_message_id,
-                direction,
             )
-            return Message(**dict(row))
 
-    async def get_message_by_admin_id(self, admin_message_id: int) -> Message | None:
-        async with self.pool.acquire() as conn:
+    async def claim_outbox(self, limit: int, lease: float) -> list[OutboxItem]:
+        # Claimed rows stay pending but are hidden until the lease runs out,
+        # so a crashed worker's batch is picked up again. A row waits while an
+        # earlier one for the same chat is leased or backing off.
+        async with self.acquire() as conn:
+            rows = await conn.fetch(
+                """
+                UPDATE outbox
+                SET attempts = attempts + 1,
+                    next_attempt_at = NOW() + make_interval(secs => $2)
+                WHERE id IN (
+                    SELECT id FROM outbox o
+                    WHERE status = 'pending' AND next_attempt_at <= NOW()
+                      AND NOT EXISTS (
+                          SELECT 1 FROM outbox earlier
+                          WHERE earlier.chat_id = o.chat_id
+                            AND earlier.status = 'pending'
+                            AND earlier.id < o.id
+                            AND earlier.next_attempt_at > NOW()
+                      )
+                    ORDER BY next_attempt_at, id
+                    LIMIT $1
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING *
+                """,
+                limit,
+                lease,
+            )
+            return sorted((from_row(OutboxItem, row) for row in rows), key=lambda item: item.id)
+
+    async def complete_outbox(self, delivered: list[tuple[int, int]]):
+        # delivered: (outbox id, message id on the user's side)
+        outbox_ids, message_ids = zip(*delivered)
+        async with self.acquire() as conn:
+            await conn.execute(
+                """
+                WITH sent AS (
+                    UPDATE outbox o
+                    SET status = 'sent', last_error = NULL
+                    FROM unnest($1::bigint[], $2::bigint[]) AS d(id, message_id)
+                    WHERE o.id = d.id
+                    RETURNING o.id, o.ticket_id, o.chat_id, d.message_id
+                )
+                INSERT INTO messages (ticket_id, user_id, user_message_id, admin_message_id, direction)
+                SELECT ticket_id, chat_id, message_id, NULL, 'outgoing'
+                FROM sent
+                WHERE ticket_id IS NOT NULL
+                ORDER BY id
+                """,
+                list(outbox_ids),
+                list(message_ids),
+            )
+
+    async def retry_outbox(self, outbox_ids: list[int], delay: float, error: str | None, attempted: bool = True):
+        # Rows that were claimed but never sent get their attempt back
+        async with self.acquire() as conn:
+            await conn.execute(
+                """
+                UPDATE outbox
+                SET next_attempt_at = NOW() + make_interval(secs => $2),
+                    last_error = COALESCE($3, last_error),
+                    attempts = attempts - CASE WHEN $4 THEN 0 ELSE 1 END
+                WHERE id = ANY($1::bigint[])
+                """,
+                outbox_ids,
+                delay,
+                error,
+                attempted,
+            )
+
+    async def fail_outbox(self, outbox_id: int, error: str):
+        async with self.acquire() as conn:
+            await conn.execute(
+                "UPDATE outbox SET status = 'failed', last_error = $2 WHERE id = $1",
+                outbox_id,
+                error,
+            )
+
+    # Broadcasts
+    async def create_broadcast(
+        self,
+        text: str | None,
+        from_chat_id: int | None,
+        from_message_id: int | None,
+        status_message_id: int,
+    ) -> Broadcast | None:
+        async with self.acquire() as conn:
             row = await conn.fetchrow(
-                "SELECT * FROM messages WHERE admin_message_id = $1", admin_message_id
+                """
+                INSERT INTO broadcasts (text, from_chat_id, from_message_id, status_message_id, total)
+                SELECT $1, $2, $3, $4, COUNT(*) FROM users
+                WHERE NOT is_blocked AND NOT bot_blocked AND id <> $5
+                ON CONFLICT (status) WHERE status = 'running' DO NOTHING
+                RETURNING *
+                """,
+                text,
+                from_chat_id,
+                from_message_id,
+                status_message_id,
+                settings.admin_id,
             )
-            return Message(**dict(row)) if row else None
+            return from_row(Broadcast, row) if row else None
 
-    async def get_ticket_by_admin_message(self, admin_message_id: int) -> Ticket | None:
-        async with self.pool.acquire() as conn:
+    async def claim_broadcast(self, lease: float) -> Broadcast | None:
+        async with self.acquire() as conn:
             row = await conn.fetchrow(
                 """
-                SELECT t.* FROM tickets t
-                JOIN messages m ON m.ticket_id = t.id
-                WHERE m.admin_message_id = $1
+                UPDATE broadcasts SET lease_until = NOW() + $1 * INTERVAL '1 second'
+                WHERE status = 'running' AND (lease_until IS NULL OR lease_until < NOW())
+                RETURNING *
                 """,
-                admin_message_id,
+                lease,
             )
-            return Ticket(**dict(row)) if row else None
+            return from_row(Broadcast, row) if row else None
 
-    # Quick replies
-    async def get_quick_replies(self) -> list[QuickReply]:
-        async with self.pool.acquire() as conn:
-            rows = await conn.fetch("SELECT * FROM quick_replies ORDER BY shortcut")
-            return [QuickReply(**dict(row)) for row in rows]
+    async def release_broadcast(self, broadcast_id: int):
+        async with self.acquire() as conn:
+            await conn.execute("UPDATE broadcasts SET lease_until = NULL WHERE id = $1", broadcast_id)
+
+    async def broadcast_recipients(self, after_user_id: int, limit: int) -> list[int]:
+        async with self.acquire() as conn:
+            rows = await conn.fetch(
+                """
+                SELECT id FROM users
+                WHERE id > $1 AND NOT is_blocked AND NOT bot_blocked AND id <> $3
+                ORDER BY id
+                LIMIT $2
+                """,
+                after_user_id,
+                limit,
+                settings.admin_id,
+            )
+            return [row["id"] for row in rows]
 
-    async def get_quick_reply(self, shortcut: str) -> QuickReply | None:
-        async with self.pool.acquire() as conn:
+    async def checkpoint_broadcast(
+        self,
+        broadcast_id: int,
+        last_user_id: int,
+        sent: int,
+        failed: int,
+        bot_blocked_ids: list[int],
+        lease: float,
+    ) -> str:
+        # Returns the broadcast status, so a stop from another instance is seen here
+        async with self.acquire() as conn:
+            async with conn.transaction():
+                if bot_blocked_ids:
+                    await conn.execute(
+                        "UPDATE users SET bot_blocked = TRUE WHERE id = ANY($1::bigint[])", bot_blocked_ids
+                    )
+                return await conn.fetchval(
+                    """
+                    UPDATE broadcasts SET
+                        last_user_id = $2,
+                        sent = sent + $3,
+                        failed = failed + $4,
+                        bot_blocked = bot_blocked + $5,
+                        lease_until = CASE WHEN status = 'running' THEN NOW() + $6 * INTERVAL '1 second' END
+                    WHERE id = $1
+                    RETURNING status
+                    """,
+                    broadcast_id,
+                    last_user_id,
+                    sent,
+                    failed,
+                    len(bot_blocked_ids),
+                    lease,
+                )
+
+    async def finish_broadcast(self, broadcast_id: int | None, status: str) -> Broadcast | None:
+        # With no id, finishes whichever broadcast is running
+        async with self.acquire() as conn:
             row = await conn.fetchrow(
-                "SELECT * FROM quick_replies WHERE shortcut = $1", shortcut
+                """
+                UPDATE broadcasts SET status = $2, finished_at = NOW(), lease_until = NULL
+                WHERE status = 'running' AND ($1::int IS NULL OR id = $1)
+                RETURNING *
+                """,
+                broadcast_id,
+                status,
             )
-            return QuickReply(**dict(row)) if row else None
+            return from_row(Broadcast, row) if row else None
+
+    # Quick replies
+    async def get_quick_replies(self) -> list[QuickReply]:
+        async with self.acquire() as conn:
+            rows = await conn.fetch("SELECT * FROM quick_replies ORDER BY shortcut")
+            return [from_row(QuickReply, row) for row in rows]
 
     async def add_quick_reply(self, shortcut: str, text: str) -> QuickReply:
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             row = await conn.fetchrow(
                 """
                 INSERT INTO quick_replies (shortcut, text)
@@ -225,65 +856,94 @@ class Database:
                 shortcut,
                 text,
             )
-            return QuickReply(**dict(row))
+            return from_row(QuickReply, row)
 
     async def delete_quick_reply(self, shortcut: str) -> bool:
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             result = await conn.execute(
                 "DELETE FROM quick_replies WHERE shortcut = $1", shortcut
             )
             return result == "DELETE 1"
 
     # Statistics
-    async def get_stats(self) -> Stats:
-        async with self.pool.acquire() as conn:
-            total_users = await conn.fetchval("SELECT COUNT(*) FROM users")
-
-            today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-            active_today = await conn.fetchval(
-                "SELECT COUNT(*) FROM users WHERE last_message_at >= $1", today
-            )
-
-            open_tickets = await conn.fetchval(
-                "SELECT COUNT(*) FROM tickets WHERE status = 'open'"
-            )
-            closed_tickets = await conn.fetchval(
-                "SELECT COUNT(*) FROM tickets WHERE status = 'closed'"
-            )
-
-            # Average response time (time between incoming and outgoing messages)
-            avg_response = await conn.fetchval(
-                """
-                SELECT AVG(EXTRACT(EPOCH FROM (outgoing.created_at - incoming.created_at)) / 60)
-                FROM messages incoming
-                JOIN messages outgoing ON incoming.ticket_id = outgoing.ticket_id
-                    AND outgoing.direction = 'outgoing'
-                    AND outgoing.created_at > incoming.created_at
-                WHERE incoming.direction = 'incoming'
-                    AND incoming.created_at >= NOW() - INTERVAL '7 days'
+    async def get_stats(self, days: int = 7) -> Stats:
+        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        async with self.acquire(read=True) as conn:
+            totals = await conn.fetchrow(
                 """
+                SELECT
+                    (SELECT COUNT(*) FROM users) AS total_users,
+                    (SELECT COUNT(*) FROM users WHERE last_message_at >= $1) AS active_today,
+                    (SELECT COUNT(*) FROM tickets WHERE status = 'open') AS open_tickets,
+                    (SELECT COUNT(*) FROM tickets WHERE status = 'closed') AS closed_tickets
+                """,
+                today,
             )
 
-            # Messages per day for last 7 days
             rows = await conn.fetch(
                 """
-                SELECT DATE(created_at) as date, COUNT(*) as count
-                FROM messages
-                WHERE created_at >= NOW() - INTERVAL '7 days'
-                GROUP BY DATE(created_at)
-                ORDER BY date
-                """
+                SELECT
+                    day,
+                    SUM(incoming + outgoing) AS count,
+                    SUM(responses) AS responses,
+                    SUM(response_seconds) AS response_seconds,
+                    SUM(responses_5m) AS responses_5m,
+                    SUM(responses_30m) AS responses_30m,
+                    SUM(responses_2h) AS responses_2h,
+                    SUM(responses_over_2h) AS responses_over_2h
+                FROM daily_message_counts
+                WHERE day > $1::date - $2::int
+                GROUP BY day
+                ORDER BY day
+                """,
+                today.date(),
+                days,
             )
-            messages_last_7_days = [(str(row["date"]), row["count"]) for row in rows]
-
-            return Stats(
-                total_users=total_users or 0,
-                active_today=active_today or 0,
-                open_tickets=open_tickets or 0,
-                closed_tickets=closed_tickets or 0,
-                avg_response_time_minutes=round(avg_response, 1) if avg_response else None,
-                messages_last_7_days=messages_last_7_days,
+
+            percentiles = await conn.fetchval(
+                """
+                SELECT percentile_cont(ARRAY[0.5, 0.9, 0.99]) WITHIN GROUP (
+                    ORDER BY EXTRACT(EPOCH FROM responded_at - received_at)
+                )
+                FROM first_response
+                WHERE received_at >= $1::date - ($2::int - 1) AND responded_at IS NOT NULL
+                """,
+                today.date(),
+                days,
             )
 
+        p50, p90, p99 = (round(value / 60, 1) for value in percentiles) if percentiles else (None, None, None)
+        histogram = [
+            (label, sum(row[column] for row in rows))
+            for label, column in RESPONSE_BUCKETS
+        ]
+
+        responses = sum(row["responses"] for row in rows)
+        response_seconds = sum(row["response_seconds"] for row in rows)
+        avg_response = response_seconds / responses / 60 if responses else None
+
+        return Stats(
+            days=days,
+            total_users=totals["total_users"],
+            active_today=totals["active_today"],
+            open_tickets=totals["open_tickets"],
+            closed_tickets=totals["closed_tickets"],
+            avg_response_time_minutes=round(avg_response, 1) if avg_response is not None else None,
+            response_p50_minutes=p50,
+            response_p90_minutes=p90,
+            response_p99_minutes=p99,
+            response_histogram=histogram,
+            messages_per_day=[(str(row["day"]), row["count"]) for row in rows],
+        )
+
 
 db = Database()
+
+Gauge("bovpn_db_pool_size", "Open pool connections", lambda: db.pool.get_size() if db.pool else 0)
+Gauge("bovpn_db_pool_idle", "Idle pool connections", lambda: db.pool.get_idle_size() if db.pool else 0)
+Gauge("bovpn_db_pool_max", "Pool size limit", lambda: db.pool.get_max_size() if db.pool else 0)
+Gauge("bovpn_db_pool_waiters", "Callers waiting for a pool connection", lambda: db.acquire_waiters)
+Gauge("bovpn_db_read_pool_size", "Open read pool connections", lambda: db.read_pool.get_size() if db.read_pool else 0)
+Gauge("bovpn_db_read_pool_idle", "Idle read pool connections", lambda: db.read_pool.get_idle_size() if db.read_pool else 0)
+Gauge("bovpn_db_replica_lag_seconds", "Read replica replay lag, -1 while unavailable", lambda: -1 if db.replica_lag is None else db.replica_lag)
+Gauge("bovpn_db_circuit_open", "1 while the database circuit breaker rejects calls", lambda: int(db.breaker.is_open))
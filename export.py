@@ -0,0 +1,132 @@
+import argparse
+import asyncio
+import html
+import logging
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+from aiogram import Bot
+from aiogram.types import FSInputFile
+
+from config import settings
+from database import EXPORT_QUERIES, db
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ("csv", "jsonl")
+DEFAULT_DAYS = 30
+
+
+def export_path(table: str, start: date, end: date, fmt: str) -> Path:
+    return Path(settings.export_dir) / f"{table}_{start}_{end}.{fmt}.gz"
+
+
+async def export(table: str, start: date, end: date, fmt: str) -> tuple[Path, int]:
+    # end is inclusive, like the dates the admin types
+    path = export_path(table, start, end, fmt)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    rows = await db.export_table(
+        table,
+        datetime.combine(start, datetime.min.time()),
+        datetime.combine(end + timedelta(days=1), datetime.min.time()),
+        fmt,
+        path,
+    )
+    return path, rows
+
+
+def parse_export_args(args: list[str], today: date) -> tuple[list[str], date, date, str]:
+    # Any order: table names, csv|jsonl and up to two YYYY-MM-DD dates
+    tables, dates, fmt = [], [], "csv"
+    for arg in args:
+        if arg in EXPORT_QUERIES:
+            tables.append(arg)
+        elif arg in FORMATS:
+            fmt = arg
+        else:
+            dates.append(date.fromisoformat(arg))
+    if len(dates) > 2:
+        raise ValueError("too many dates")
+    start = dates[0] if dates else today - timedelta(days=DEFAULT_DAYS - 1)
+    end = dates[1] if len(dates) > 1 else today
+    if start > end:
+        raise ValueError("start after end")
+    return tables or list(EXPORT_QUERIES), start, end, fmt
+
+
+# Admin exports run one at a time in the background, so a long export does
+# not hold up the admin's other commands
+class ExportJobs:
+    def __init__(self):
+        self._lock = asyncio.Lock()
+        self._tasks: set[asyncio.Task] = set()
+
+    def submit(self, bot: Bot, tables: list[str], start: date, end: date, fmt: str):
+        task = asyncio.create_task(self._run(bot, tables, start, end, fmt))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def close(self):
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _run(self, bot: Bot, tables: list[str], start: date, end: date, fmt: str):
+        async with self._lock:
+            for table in tables:
+                try:
+                    path, rows = await export(table, start, end, fmt)
+                except Exception as e:
+                    logger.exception("Export of %s failed", table)
+                    await bot.send_message(settings.admin_id, f"Ошибка экспорта {table}: {html.escape(str(e))}")
+                    continue
+                await self._deliver(bot, table, path, rows, start, end)
+
+    async def _deliver(self, bot: Bot, table: str, path: Path, rows: int, start: date, end: date):
+        caption = f"📦 {table}: {rows} строк за {start} — {end}"
+        if path.stat().st_size > settings.export_max_upload:
+            await bot.send_message(
+                settings.admin_id,
+                f"{caption}\nФайл больше лимита Telegram, он сохранён на сервере: {html.escape(str(path))}",
+            )
+            return
+        try:
+            await bot.send_document(settings.admin_id, FSInputFile(path), caption=caption)
+        except Exception as e:
+            logger.exception("Failed to send export %s", path)
+            await bot.send_message(
+                settings.admin_id,
+                f"{caption}\nНе удалось отправить файл ({html.escape(str(e))}), он сохранён на сервере: "
+                f"{html.escape(str(path))}",
+            )
+            return
+        path.unlink()
+
+
+exports = ExportJobs()
+
+
+async def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m export",
+        description="Export tickets, messages and users for a date range to gzip-compressed CSV or JSONL",
+    )
+    parser.add_argument("tables", nargs="*", metavar="table", help=f"one of: {', '.join(EXPORT_QUERIES)} (default: all)")
+    parser.add_argument("--from", dest="start", type=date.fromisoformat, help=f"first day, YYYY-MM-DD (default: {DEFAULT_DAYS} days ago)")
+    parser.add_argument("--to", dest="end", type=date.fromisoformat, help="last day, inclusive (default: today)")
+    parser.add_argument("--format", choices=FORMATS, default="csv")
+    args = parser.parse_args()
+    for table in args.tables:
+        if table not in EXPORT_QUERIES:
+            parser.error(f"unknown table {table!r}")
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    end = args.end or date.today()
+    start = args.start or end - timedelta(days=DEFAULT_DAYS - 1)
+    for table in args.tables or EXPORT_QUERIES:
+        path, rows = await export(table, start, end, args.format)
+        logger.info("Exported %d %s rows to %s", rows, table, path)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -3,12 +3,27 @@ import logging
 
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.base import BaseSession
 from aiogram.enums import ParseMode
 
+from blocked_users import blocked_users
+from broadcast import broadcaster
 from config import settings
 from database import db
-from middleware import UserTrackingMiddleware
+from export import exports
+from metrics import HandlerMetricsMiddleware, TelegramMetricsMiddleware, start_metrics_server
+from middleware import UserSequencingMiddleware, UserTrackingMiddleware, throttling
+from migrate import migrate
+from outbound import outbound
+from outbox import outbox
+from partitions import partitions
+from quick_replies import quick_replies
 from routers import user_router, admin_router
+from routers.user import bursts
+from spool import spool
+from tracing import TracingMiddleware
+from user_cache import user_cache
+from webhook import run_webhook
 
 
 logging.basicConfig(
@@ -21,8 +36,17 @@ logger = logging.getLogger(__name__)
 async def on_startup(bot: Bot):
     logger.info("Connecting to database...")
     await db.connect()
-    await db.init_tables()
-    logger.info("Database initialized")
+    version = await migrate()
+    logger.info(f"Database schema at version {version}")
+
+    await db.warm_admin_messages(settings.admin_index_size)
+    await quick_replies.start()
+    await blocked_users.start()
+    await user_cache.start()
+    await outbox.start(bot)
+    await broadcaster.start(bot)
+    await spool.start()
+    await partitions.start()
 
     me = await bot.get_me()
     logger.info(f"Bot started: @{me.username}")
@@ -30,18 +54,35 @@ async def on_startup(bot: Bot):
 
 async def on_shutdown(bot: Bot):
     logger.info("Shutting down...")
+    await bursts.close()
+    await partitions.close()
+    await broadcaster.close()
+    await exports.close()
+    await outbox.close()
+    await user_cache.close()
+    await spool.close()
     await db.disconnect()
     logger.info("Database disconnected")
 
 
-async def main():
+def create_bot(session: BaseSession | None = None) -> Bot:
     bot = Bot(
         token=settings.bot_token,
+        session=session,
         default=DefaultBotProperties(parse_mode=ParseMode.HTML),
     )
+    bot.session.middleware(outbound)
+    bot.session.middleware(TelegramMetricsMiddleware())
+    return bot
+
 
+def create_dispatcher() -> Dispatcher:
     dp = Dispatcher()
 
+    dp.update.outer_middleware(TracingMiddleware())
+    dp.message.outer_middleware(throttling)
+    dp.message.outer_middleware(UserSequencingMiddleware())
+    dp.message.middleware(HandlerMetricsMiddleware())
     dp.message.middleware(UserTrackingMiddleware())
 
     dp.include_router(admin_router)
@@ -49,8 +90,26 @@ async def main():
 
     dp.startup.register(on_startup)
     dp.shutdown.register(on_shutdown)
+    return dp
 
-    await dp.start_polling(bot)
+
+async def main():
+    bot = create_bot()
+    dp = create_dispatcher()
+
+    metrics_runner = None
+    if settings.metrics_port:
+        metrics_runner = await start_metrics_server(settings.metrics_host, settings.metrics_port)
+        logger.info(f"Metrics available on {settings.metrics_host}:{settings.metrics_port}/metrics")
+
+    try:
+        if settings.webhook_enabled:
+            await run_webhook(dp, bot)
+        else:
+            await dp.start_polling(bot)
+    finally:
+        if metrics_runner:
+            await metrics_runner.cleanup()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,33 @@
+from collections import OrderedDict
+from typing import NamedTuple
+
+from config import settings
+
+
+class AdminMessageRef(NamedTuple):
+    user_id: int
+    ticket_id: int
+
+
+class AdminMessageIndex:
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._refs: OrderedDict[int, AdminMessageRef] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._refs)
+
+    def get(self, admin_message_id: int) -> AdminMessageRef | None:
+        ref = self._refs.get(admin_message_id)
+        if ref:
+            self._refs.move_to_end(admin_message_id)
+        return ref
+
+    def remember(self, admin_message_id: int, ref: AdminMessageRef):
+        self._refs[admin_message_id] = ref
+        self._refs.move_to_end(admin_message_id)
+        while len(self._refs) > self.max_size:
+            self._refs.popitem(last=False)
+
+
+admin_messages = AdminMessageIndex(settings.admin_index_size)
@@ -0,0 +1,237 @@
+import functools
+import inspect
+import time
+from bisect import bisect_left
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import TelegramObject
+from aiohttp import web
+
+from tracing import span
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values: dict[tuple[str, ...], float] = {}
+        registry.register(self)
+
+    def inc(self, *labels: str, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def samples(self) -> list[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+            for labels, value in self._values.items()
+        ]
+
+
+class Gauge:
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, read: Callable[[], float]):
+        self.name = name
+        self.help = help
+        self.read = read
+        registry.register(self)
+
+    def samples(self) -> list[str]:
+        return [f"{self.name} {self.read()}"]
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # labels -> [per-bucket counts..., +Inf count, sum]
+        self._series: dict[tuple[str, ...], list[float]] = {}
+        registry.register(self)
+
+    def observe(self, value: float, *labels: str):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 2)
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def count(self, *labels: str) -> int:
+        series = self._series.get(labels)
+        return int(sum(series[:-1])) if series else 0
+
+    def total(self) -> int:
+        return int(sum(sum(series[:-1]) for series in self._series.values()))
+
+    def samples(self) -> list[str]:
+        lines = []
+        for labels, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = _format_labels(self.labelnames, labels, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            cumulative += series[len(self.buckets)]
+            le = _format_labels(self.labelnames, labels, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{le} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {series[-1]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list[Counter | Gauge | Histogram] = []
+
+    def register(self, metric: Counter | Gauge | Histogram):
+        self._metrics.append(metric)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+db_query_seconds = Histogram(
+    "bovpn_db_query_duration_seconds", "Database method latency", ("method",)
+)
+db_query_errors = Counter(
+    "bovpn_db_query_errors_total", "Database method failures", ("method", "error")
+)
+db_pool_acquire_seconds = Histogram(
+    "bovpn_db_pool_acquire_seconds", "Time spent waiting for a pool connection", ("pool",)
+)
+handler_seconds = Histogram(
+    "bovpn_handler_duration_seconds", "Update handler latency", ("handler",)
+)
+handler_errors = Counter(
+    "bovpn_handler_errors_total", "Update handler failures", ("handler", "error")
+)
+telegram_request_seconds = Histogram(
+    "bovpn_telegram_request_duration_seconds", "Bot API call latency", ("method",)
+)
+telegram_request_errors = Counter(
+    "bovpn_telegram_request_errors_total", "Bot API call failures", ("method", "error")
+)
+
+throttled_messages = Counter(
+    "bovpn_throttled_messages_total", "User messages suppressed by the flood throttle"
+)
+throttle_summaries = Counter(
+    "bovpn_throttle_summaries_total", "Flood summaries sent to the admin chat"
+)
+
+
+def instrument(cls: type) -> type:
+    for name, func in list(vars(cls).items()):
+        if name.startswith("_") or not inspect.iscoroutinefunction(func):
+            continue
+        setattr(cls, name, _timed(func))
+    return cls
+
+
+def _timed(func: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+    name = func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(*args: Any, **kwargs: Any) -> Any:
+        started = time.perf_counter()
+        try:
+            with span(f"db.{name}"):
+                return await func(*args, **kwargs)
+        except Exception as e:
+            db_query_errors.inc(name, type(e).__name__)
+            raise
+        finally:
+            db_query_seconds.observe(time.perf_counter() - started, name)
+
+    return wrapper
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        name = data["handler"].callback.__name__ if "handler" in data else "unknown"
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            handler_errors.inc(name, type(e).__name__)
+            raise
+        finally:
+            handler_seconds.observe(time.perf_counter() - started, name)
+
+
+class TelegramMetricsMiddleware(BaseRequestMiddleware):
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        name = method.__api_method__
+        started = time.perf_counter()
+        try:
+            with span(f"telegram.{name}"):
+                return await make_request(bot, method)
+        except Exception as e:
+            telegram_request_errors.inc(name, type(e).__name__)
+            raise
+        finally:
+            telegram_request_seconds.observe(time.perf_counter() - started, name)
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(
+            text=registry.render(),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+        )
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -1,10 +1,156 @@
+import asyncio
+import html
+import logging
+import time
+from collections import OrderedDict
+from collections.abc import AsyncIterator, Hashable
+from contextlib import asynccontextmanager
 from typing import Any, Awaitable, Callable
 
-from aiogram import BaseMiddleware
+from aiogram import BaseMiddleware, Bot
 from aiogram.types import Message, TelegramObject
+from aiogram.types import User as TelegramUser
 
-from database import db
+from blocked_users import blocked_users
 from config import settings
+from metrics import Gauge, throttle_summaries, throttled_messages
+from ratelimit import TokenBucket
+from tracing import record_span, span
+from user_cache import user_cache
+
+logger = logging.getLogger(__name__)
+
+
+class KeyedLock:
+    def __init__(self):
+        self._locks: dict[Hashable, tuple[asyncio.Lock, int]] = {}
+
+    @asynccontextmanager
+    async def hold(self, key: Hashable) -> AsyncIterator[None]:
+        lock, users = self._locks.get(key, (None, 0))
+        if lock is None:
+            lock = asyncio.Lock()
+        self._locks[key] = (lock, users + 1)
+        try:
+            async with lock:
+                yield
+        finally:
+            lock, users = self._locks[key]
+            if users == 1:
+                del self._locks[key]
+            else:
+                self._locks[key] = (lock, users - 1)
+
+
+user_locks = KeyedLock()
+
+
+class UserSequencingMiddleware(BaseMiddleware):
+    # Registered as an outer middleware so the lock is taken before any await,
+    # in the order updates arrive: strict order per user, parallel across users.
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        if isinstance(event, Message) and event.from_user and event.from_user.id != settings.admin_id:
+            started = time.perf_counter()
+            async with user_locks.hold(event.from_user.id):
+                record_span("middleware.user_lock_wait", started, time.perf_counter())
+                return await handler(event, data)
+
+        return await handler(event, data)
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    # Outer middleware ahead of the user lock: over-limit messages cost no DB
+    # work and no Bot API calls beyond one summary per flood.
+    def __init__(self):
+        self._buckets: OrderedDict[int, TokenBucket] = OrderedDict()
+        # Last album per user and whether it got through: an album costs one token
+        self._albums: OrderedDict[int, tuple[str, bool]] = OrderedDict()
+        self._suppressed: dict[int, int] = {}
+        self._summary_tasks: set[asyncio.Task] = set()
+
+    @property
+    def flooding_users(self) -> int:
+        return len(self._suppressed)
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        if (
+            settings.throttle_rate > 0
+            and isinstance(event, Message)
+            and event.from_user
+            and event.from_user.id != settings.admin_id
+            and event.from_user.id not in blocked_users
+            and not self._allow(event.from_user.id, event.media_group_id)
+        ):
+            throttled_messages.inc()
+            self._suppress(data["bot"], event.from_user)
+            return None
+
+        return await handler(event, data)
+
+    def _allow(self, user_id: int, media_group_id: str | None) -> bool:
+        if media_group_id is None:
+            return self._bucket(user_id).try_acquire()
+        album = self._albums.get(user_id)
+        if album and album[0] == media_group_id:
+            return album[1]
+        allowed = self._bucket(user_id).try_acquire()
+        self._albums[user_id] = (media_group_id, allowed)
+        self._albums.move_to_end(user_id)
+        while len(self._albums) > settings.user_cache_size:
+            self._albums.popitem(last=False)
+        return allowed
+
+    def _bucket(self, user_id: int) -> TokenBucket:
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = TokenBucket(settings.throttle_rate, settings.throttle_burst)
+        self._buckets[user_id] = bucket
+        self._buckets.move_to_end(user_id)
+        while len(self._buckets) > settings.user_cache_size:
+            self._buckets.popitem(last=False)
+        return bucket
+
+    def _suppress(self, bot: Bot, user: TelegramUser):
+        count = self._suppressed.get(user.id, 0)
+        self._suppressed[user.id] = count + 1
+        if count == 0:
+            task = asyncio.create_task(self._summarize_later(bot, user))
+            self._summary_tasks.add(task)
+            task.add_done_callback(self._summary_tasks.discard)
+
+    async def _summarize_later(self, bot: Bot, user: TelegramUser):
+        await asyncio.sleep(settings.throttle_summary_delay)
+        count = self._suppressed.pop(user.id, 0)
+        username_str = f"@{user.username}" if user.username else "нет"
+        try:
+            await bot.send_message(
+                settings.admin_id,
+                f"⚠️ Флуд от {html.escape(user.full_name)} ({html.escape(username_str)})\n"
+                f"🆔 ID: <code>{user.id}</code>\n"
+                f"🔇 Скрыто ещё сообщений: {count}",
+            )
+            throttle_summaries.inc()
+        except Exception:
+            logger.exception("Failed to send flood summary for user %s", user.id)
+
+
+throttling = ThrottlingMiddleware()
+
+Gauge(
+    "bovpn_throttle_flooding_users",
+    "Users with suppressed messages awaiting a summary",
+    lambda: throttling.flooding_users,
+)
 
 
 class UserTrackingMiddleware(BaseMiddleware):
@@ -16,13 +162,20 @@ class UserTrackingMiddleware(BaseMiddleware):
     ) -> Any:
         if isinstance(event, Message) and event.from_user:
             user = event.from_user
+            if user.id in blocked_users:
+                # Dropped before any DB work; the notice itself is rate limited per user
+                if blocked_users.should_notify(user.id):
+                    await event.answer("Вы заблокированы в поддержке.")
+                return None
+
             if user.id != settings.admin_id:
-                db_user = await db.upsert_user(
-                    user_id=user.id,
-                    username=user.username,
-                    first_name=user.first_name,
-                    last_name=user.last_name,
-                )
+                with span("middleware.user_tracking"):
+                    db_user = await user_cache.touch(
+                        user_id=user.id,
+                        username=user.username,
+                        first_name=user.first_name,
+                        last_name=user.last_name,
+                    )
                 data["db_user"] = db_user
 
         return await handler(event, data)
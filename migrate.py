@@ -0,0 +1,199 @@
+import asyncio
+import logging
+import re
+from dataclasses import dataclass
+from pathlib import Path
+
+import asyncpg
+
+from config import settings
+from database import db
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = Path(__file__).parent / "migrations"
+MIGRATION_FILE = re.compile(r"(\d+)_(\w+)\.sql")
+
+# Files starting with this line run statement by statement outside a
+# transaction, which CREATE INDEX CONCURRENTLY requires; statements are split
+# on a trailing ";", so keep DO blocks out of them
+NO_TRANSACTION = "-- migrate: no-transaction"
+
+CONCURRENT_INDEX = re.compile(
+    r"(CREATE\s+(?:UNIQUE\s+)?INDEX)\s+CONCURRENTLY\s+IF\s+NOT\s+EXISTS\s+(\w+)\s+ON\s+(\w+)(.*)",
+    re.IGNORECASE | re.DOTALL,
+)
+STATEMENT_END = re.compile(r";\s*$", re.MULTILINE)
+
+
+@dataclass(slots=True)
+class Migration:
+    version: int
+    name: str
+    sql: str
+
+    @property
+    def transactional(self) -> bool:
+        return not self.sql.startswith(NO_TRANSACTION)
+
+    def statements(self) -> list[str]:
+        statements = []
+        for chunk in STATEMENT_END.split(self.sql):
+            lines = [line for line in chunk.strip().splitlines() if not line.lstrip().startswith("--")]
+            if lines:
+                statements.append("\n".join(lines))
+        return statements
+
+
+def load_migrations(directory: Path = MIGRATIONS_DIR) -> list[Migration]:
+    migrations = []
+    for path in directory.glob("*.sql"):
+        match = MIGRATION_FILE.fullmatch(path.name)
+        if not match:
+            raise ValueError(f"Bad migration file name: {path.name}")
+        migrations.append(Migration(int(match[1]), match[2], path.read_text()))
+    migrations.sort(key=lambda m: m.version)
+    versions = [m.version for m in migrations]
+    if len(set(versions)) != len(versions):
+        raise ValueError("Duplicate migration versions")
+    return migrations
+
+
+async def current_version(conn: asyncpg.Connection) -> int:
+    try:
+        return await conn.fetchval("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    except asyncpg.UndefinedTableError:
+        return 0
+
+
+async def migrate() -> int:
+    migrations = load_migrations()
+    latest = migrations[-1].version if migrations else 0
+
+    # Fast path: every instance after the first one starts with a single query
+    async with db.acquire() as conn:
+        version = await current_version(conn)
+    if version >= latest:
+        return version
+
+    conn = await db.open_connection()
+    try:
+        # Instances starting together queue here; the ones that get the lock
+        # later find the schema already migrated
+        await conn.execute("SELECT pg_advisory_lock(hashtext('bovpn_schema_migrations'))")
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INT PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TIMESTAMP DEFAULT NOW()
+            )
+        """)
+        await conn.execute(f"SET lock_timeout = {int(settings.migration_lock_timeout * 1000)}")
+
+        version = await current_version(conn)
+        for migration in migrations:
+            if migration.version <= version:
+                continue
+            logger.info("Applying migration %04d_%s", migration.version, migration.name)
+            await _apply_with_retries(conn, migration)
+            version = migration.version
+    finally:
+        await conn.close()
+    return version
+
+
+# Migrations wait at most lock_timeout for locks on busy tables, then back
+# off and try again instead of stalling every query queued behind them
+async def _apply_with_retries(conn: asyncpg.Connection, migration: Migration):
+    for attempt in range(1, settings.migration_lock_retries + 1):
+        try:
+            await _apply(conn, migration)
+            return
+        except asyncpg.LockNotAvailableError:
+            if attempt == settings.migration_lock_retries:
+                raise
+            logger.warning("Migration %04d waiting for a table lock, retrying", migration.version)
+            await asyncio.sleep(attempt)
+
+
+async def _apply(conn: asyncpg.Connection, migration: Migration):
+    if migration.transactional:
+        async with conn.transaction():
+            await conn.execute(migration.sql)
+            await _record(conn, migration)
+        return
+
+    for statement in migration.statements():
+        index = CONCURRENT_INDEX.match(statement)
+        if index:
+            await _create_index_concurrently(conn, *index.groups())
+        else:
+            await conn.execute(statement)
+    await _record(conn, migration)
+
+
+async def _create_index_concurrently(conn: asyncpg.Connection, create: str, name: str, table: str, definition: str):
+    relkind = await conn.fetchval("SELECT relkind::text FROM pg_class WHERE oid = to_regclass($1)", table)
+    if relkind != "p":
+        await _drop_invalid_index(conn, name)
+        await conn.execute(f"{create} CONCURRENTLY IF NOT EXISTS {name} ON {table}{definition}")
+        return
+
+    # Partitioned tables can't be indexed concurrently: create the parent index
+    # without recursing, build each partition's index concurrently and attach
+    # it. The parent becomes valid once every partition has one; partitions
+    # created in between get theirs from the parent.
+    await conn.execute(f"{create} IF NOT EXISTS {name} ON ONLY {table}{definition}")
+    partitions = await conn.fetch(
+        """
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass($1)
+            AND NOT EXISTS (
+                SELECT 1 FROM pg_inherits ii
+                JOIN pg_index x ON x.indexrelid = ii.inhrelid
+                WHERE ii.inhparent = to_regclass($2) AND x.indrelid = c.oid
+            )
+        ORDER BY c.relname
+        """,
+        table, name,
+    )
+    for row in partitions:
+        partition_index = f"{row['relname']}_{name}"[:63]
+        await _drop_invalid_index(conn, partition_index)
+        await conn.execute(
+            f"{create} CONCURRENTLY IF NOT EXISTS {partition_index} ON {row['relname']}{definition}"
+        )
+        await conn.execute(f"ALTER INDEX {name} ATTACH PARTITION {partition_index}")
+
+
+# A failed CREATE INDEX CONCURRENTLY leaves an invalid index behind that
+# IF NOT EXISTS would otherwise skip on the next attempt
+async def _drop_invalid_index(conn: asyncpg.Connection, name: str):
+    invalid = await conn.fetchval(
+        "SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass($1)", name
+    )
+    if invalid:
+        logger.warning("Dropping invalid index %s left by an interrupted migration", name)
+        await conn.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"')
+
+
+async def _record(conn: asyncpg.Connection, migration: Migration):
+    await conn.execute(
+        "INSERT INTO schema_version (version, name) VALUES ($1, $2) ON CONFLICT DO NOTHING",
+        migration.version, migration.name,
+    )
+
+
+async def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    await db.connect()
+    try:
+        version = await migrate()
+    finally:
+        await db.disconnect()
+    logger.info("Schema at version %d", version)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,37 @@
+CREATE TABLE IF NOT EXISTS users (
+    id BIGINT PRIMARY KEY,
+    username VARCHAR(255),
+    first_name VARCHAR(255),
+    last_name VARCHAR(255),
+    is_blocked BOOLEAN DEFAULT FALSE,
+    created_at TIMESTAMP DEFAULT NOW(),
+    last_message_at TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS tickets (
+    id SERIAL PRIMARY KEY,
+    user_id BIGINT REFERENCES users(id),
+    status VARCHAR(20) DEFAULT 'open',
+    created_at TIMESTAMP DEFAULT NOW(),
+    closed_at TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS messages (
+    id SERIAL PRIMARY KEY,
+    ticket_id INT REFERENCES tickets(id),
+    user_id BIGINT REFERENCES users(id),
+    user_message_id BIGINT,
+    admin_message_id BIGINT,
+    direction VARCHAR(10),
+    created_at TIMESTAMP DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS quick_replies (
+    id SERIAL PRIMARY KEY,
+    shortcut VARCHAR(50) UNIQUE,
+    text TEXT
+);
+
+CREATE INDEX IF NOT EXISTS idx_messages_admin_message_id ON messages(admin_message_id);
+CREATE INDEX IF NOT EXISTS idx_messages_ticket_id ON messages(ticket_id);
+CREATE INDEX IF NOT EXISTS idx_tickets_user_id ON tickets(user_id);
@@ -0,0 +1,15 @@
+-- At most one open ticket per user; older duplicates are closed once
+DO $$
+BEGIN
+    IF to_regclass('uq_tickets_open_user') IS NULL THEN
+        UPDATE tickets t SET status = 'closed', closed_at = NOW()
+        WHERE t.status = 'open' AND EXISTS (
+            SELECT 1 FROM tickets n
+            WHERE n.user_id = t.user_id
+                AND n.status = 'open'
+                AND (n.created_at, n.id) > (t.created_at, t.id)
+        );
+
+        CREATE UNIQUE INDEX uq_tickets_open_user ON tickets(user_id) WHERE status = 'open';
+    END IF;
+END $$;
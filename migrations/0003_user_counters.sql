@@ -0,0 +1,40 @@
+-- Per-user counters, backfilled once when the columns are added
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'users' AND column_name = 'message_count'
+    ) THEN
+        ALTER TABLE users
+            ADD COLUMN message_count INT NOT NULL DEFAULT 0,
+            ADD COLUMN ticket_count INT NOT NULL DEFAULT 0;
+
+        UPDATE users u SET
+            message_count = (SELECT COUNT(*) FROM messages m WHERE m.user_id = u.id),
+            ticket_count = (SELECT COUNT(*) FROM tickets t WHERE t.user_id = u.id);
+    END IF;
+END $$;
+
+CREATE OR REPLACE FUNCTION count_user_message() RETURNS trigger AS $$
+BEGIN
+    UPDATE users SET message_count = message_count + 1 WHERE id = NEW.user_id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION count_user_ticket() RETURNS trigger AS $$
+BEGIN
+    UPDATE users SET ticket_count = ticket_count + 1 WHERE id = NEW.user_id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_messages_user_count ON messages;
+CREATE TRIGGER trg_messages_user_count
+    AFTER INSERT ON messages
+    FOR EACH ROW EXECUTE FUNCTION count_user_message();
+
+DROP TRIGGER IF EXISTS trg_tickets_user_count ON tickets;
+CREATE TRIGGER trg_tickets_user_count
+    AFTER INSERT ON tickets
+    FOR EACH ROW EXECUTE FUNCTION count_user_ticket();
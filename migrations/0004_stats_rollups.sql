@@ -0,0 +1,147 @@
+-- Statistics rollups, backfilled once when the tables are created
+DO $$
+BEGIN
+    IF to_regclass('first_response') IS NULL THEN
+        CREATE TABLE first_response (
+            message_id INT PRIMARY KEY,
+            ticket_id INT,
+            received_at TIMESTAMP NOT NULL,
+            responded_at TIMESTAMP
+        );
+
+        CREATE TABLE daily_message_counts (
+            day DATE PRIMARY KEY,
+            incoming INT NOT NULL DEFAULT 0,
+            outgoing INT NOT NULL DEFAULT 0,
+            responses INT NOT NULL DEFAULT 0,
+            response_seconds DOUBLE PRECISION NOT NULL DEFAULT 0
+        );
+
+        INSERT INTO first_response (message_id, ticket_id, received_at, responded_at)
+        SELECT i.id, i.ticket_id, i.created_at, (
+            SELECT MIN(o.created_at) FROM messages o
+            WHERE o.ticket_id = i.ticket_id
+                AND o.direction = 'outgoing'
+                AND o.created_at >= i.created_at
+        )
+        FROM messages i
+        WHERE i.direction = 'incoming' AND i.created_at IS NOT NULL;
+
+        INSERT INTO daily_message_counts (day, incoming, outgoing)
+        SELECT
+            created_at::date,
+            COUNT(*) FILTER (WHERE direction = 'incoming'),
+            COUNT(*) FILTER (WHERE direction = 'outgoing')
+        FROM messages
+        WHERE created_at IS NOT NULL
+        GROUP BY 1;
+
+        UPDATE daily_message_counts d SET
+            responses = r.responses,
+            response_seconds = r.response_seconds
+        FROM (
+            SELECT
+                received_at::date AS day,
+                COUNT(*) AS responses,
+                SUM(EXTRACT(EPOCH FROM responded_at - received_at)) AS response_seconds
+            FROM first_response
+            WHERE responded_at IS NOT NULL
+            GROUP BY 1
+        ) r
+        WHERE d.day = r.day;
+    END IF;
+END $$;
+
+-- First-response SLA buckets: <5m, <30m, <2h, >=2h
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'daily_message_counts' AND column_name = 'responses_5m'
+    ) THEN
+        ALTER TABLE daily_message_counts
+            ADD COLUMN responses_5m INT NOT NULL DEFAULT 0,
+            ADD COLUMN responses_30m INT NOT NULL DEFAULT 0,
+            ADD COLUMN responses_2h INT NOT NULL DEFAULT 0,
+            ADD COLUMN responses_over_2h INT NOT NULL DEFAULT 0;
+
+        UPDATE daily_message_counts d SET
+            responses_5m = r.responses_5m,
+            responses_30m = r.responses_30m,
+            responses_2h = r.responses_2h,
+            responses_over_2h = r.responses_over_2h
+        FROM (
+            SELECT
+                received_at::date AS day,
+                COUNT(*) FILTER (WHERE responded_at - received_at < INTERVAL '5 minutes') AS responses_5m,
+                COUNT(*) FILTER (WHERE responded_at - received_at >= INTERVAL '5 minutes'
+                    AND responded_at - received_at < INTERVAL '30 minutes') AS responses_30m,
+                COUNT(*) FILTER (WHERE responded_at - received_at >= INTERVAL '30 minutes'
+                    AND responded_at - received_at < INTERVAL '2 hours') AS responses_2h,
+                COUNT(*) FILTER (WHERE responded_at - received_at >= INTERVAL '2 hours') AS responses_over_2h
+            FROM first_response
+            WHERE responded_at IS NOT NULL
+            GROUP BY 1
+        ) r
+        WHERE d.day = r.day;
+    END IF;
+END $$;
+
+CREATE INDEX IF NOT EXISTS idx_first_response_pending
+    ON first_response(ticket_id) WHERE responded_at IS NULL;
+CREATE INDEX IF NOT EXISTS idx_first_response_received_at
+    ON first_response(received_at);
+
+CREATE OR REPLACE FUNCTION track_message_stats() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO daily_message_counts (day, incoming, outgoing)
+    VALUES (
+        NEW.created_at::date,
+        (NEW.direction = 'incoming')::int,
+        (NEW.direction = 'outgoing')::int
+    )
+    ON CONFLICT (day) DO UPDATE SET
+        incoming = daily_message_counts.incoming + EXCLUDED.incoming,
+        outgoing = daily_message_counts.outgoing + EXCLUDED.outgoing;
+
+    IF NEW.direction = 'incoming' THEN
+        INSERT INTO first_response (message_id, ticket_id, received_at)
+        VALUES (NEW.id, NEW.ticket_id, NEW.created_at);
+    ELSIF NEW.direction = 'outgoing' THEN
+        WITH answered AS (
+            UPDATE first_response SET responded_at = NEW.created_at
+            WHERE ticket_id = NEW.ticket_id
+                AND responded_at IS NULL
+                AND received_at <= NEW.created_at
+            RETURNING received_at, NEW.created_at - received_at AS elapsed
+        )
+        INSERT INTO daily_message_counts (
+            day, responses, response_seconds,
+            responses_5m, responses_30m, responses_2h, responses_over_2h
+        )
+        SELECT
+            received_at::date,
+            COUNT(*),
+            SUM(EXTRACT(EPOCH FROM elapsed)),
+            COUNT(*) FILTER (WHERE elapsed < INTERVAL '5 minutes'),
+            COUNT(*) FILTER (WHERE elapsed >= INTERVAL '5 minutes' AND elapsed < INTERVAL '30 minutes'),
+            COUNT(*) FILTER (WHERE elapsed >= INTERVAL '30 minutes' AND elapsed < INTERVAL '2 hours'),
+            COUNT(*) FILTER (WHERE elapsed >= INTERVAL '2 hours')
+        FROM answered
+        GROUP BY 1
+        ON CONFLICT (day) DO UPDATE SET
+            responses = daily_message_counts.responses + EXCLUDED.responses,
+            response_seconds = daily_message_counts.response_seconds + EXCLUDED.response_seconds,
+            responses_5m = daily_message_counts.responses_5m + EXCLUDED.responses_5m,
+            responses_30m = daily_message_counts.responses_30m + EXCLUDED.responses_30m,
+            responses_2h = daily_message_counts.responses_2h + EXCLUDED.responses_2h,
+            responses_over_2h = daily_message_counts.responses_over_2h + EXCLUDED.responses_over_2h;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_messages_stats ON messages;
+CREATE TRIGGER trg_messages_stats
+    AFTER INSERT ON messages
+    FOR EACH ROW EXECUTE FUNCTION track_message_stats();
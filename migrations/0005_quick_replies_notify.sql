@@ -0,0 +1,11 @@
+CREATE OR REPLACE FUNCTION notify_quick_replies() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('quick_replies', '');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_quick_replies_notify ON quick_replies;
+CREATE TRIGGER trg_quick_replies_notify
+    AFTER INSERT OR UPDATE OR DELETE ON quick_replies
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_quick_replies();
@@ -0,0 +1,15 @@
+CREATE OR REPLACE FUNCTION notify_blocked_users() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('blocked_users', NEW.id || ':' || CASE WHEN NEW.is_blocked THEN 't' ELSE 'f' END);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_users_blocked_notify ON users;
+CREATE TRIGGER trg_users_blocked_notify
+    AFTER UPDATE OF is_blocked ON users
+    FOR EACH ROW
+    WHEN (OLD.is_blocked IS DISTINCT FROM NEW.is_blocked)
+    EXECUTE FUNCTION notify_blocked_users();
+
+CREATE INDEX IF NOT EXISTS idx_users_blocked ON users(id) WHERE is_blocked;
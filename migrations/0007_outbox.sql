@@ -0,0 +1,19 @@
+-- Outgoing messages to users, delivered by outbox.OutboxWorker
+CREATE TABLE IF NOT EXISTS outbox (
+    id BIGSERIAL PRIMARY KEY,
+    chat_id BIGINT NOT NULL,
+    kind VARCHAR(10) NOT NULL,
+    ticket_id INT REFERENCES tickets(id),
+    text TEXT,
+    from_chat_id BIGINT,
+    from_message_id BIGINT,
+    admin_message_id BIGINT,
+    status VARCHAR(10) NOT NULL DEFAULT 'pending',
+    attempts INT NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    last_error TEXT,
+    created_at TIMESTAMP DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(next_attempt_at, id) WHERE status = 'pending';
+CREATE INDEX IF NOT EXISTS idx_outbox_chat ON outbox(chat_id, id) WHERE status = 'pending';
@@ -0,0 +1,95 @@
+-- Messages are range partitioned by month. A table from before
+-- partitioning becomes the catch-all partition for older rows.
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_class WHERE oid = to_regclass('messages') AND relkind = 'r') THEN
+        RETURN;
+    END IF;
+
+    IF NOT EXISTS (SELECT 1 FROM messages) THEN
+        DROP TABLE messages;
+    ELSE
+        ALTER TABLE messages RENAME TO messages_legacy;
+        ALTER INDEX IF EXISTS idx_messages_admin_message_id RENAME TO messages_legacy_admin_message_id_idx;
+        ALTER INDEX IF EXISTS idx_messages_ticket_id RENAME TO messages_legacy_ticket_id_idx;
+        ALTER SEQUENCE IF EXISTS messages_id_seq RENAME TO messages_legacy_id_seq;
+        DROP TRIGGER IF EXISTS trg_messages_user_count ON messages_legacy;
+        DROP TRIGGER IF EXISTS trg_messages_stats ON messages_legacy;
+        UPDATE messages_legacy SET created_at = '-infinity' WHERE created_at IS NULL;
+        ALTER TABLE messages_legacy
+            ALTER COLUMN created_at SET NOT NULL,
+            DROP CONSTRAINT messages_pkey,
+            ADD CONSTRAINT messages_legacy_pkey PRIMARY KEY (id, created_at);
+        ALTER TABLE messages_legacy RENAME CONSTRAINT messages_ticket_id_fkey TO messages_legacy_ticket_id_fkey;
+        ALTER TABLE messages_legacy RENAME CONSTRAINT messages_user_id_fkey TO messages_legacy_user_id_fkey;
+    END IF;
+END $$;
+
+CREATE TABLE IF NOT EXISTS messages (
+    id SERIAL,
+    ticket_id INT REFERENCES tickets(id),
+    user_id BIGINT REFERENCES users(id),
+    user_message_id BIGINT,
+    admin_message_id BIGINT,
+    direction VARCHAR(10),
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+DO $$
+BEGIN
+    IF to_regclass('messages_legacy') IS NOT NULL AND NOT EXISTS (
+        SELECT 1 FROM pg_inherits WHERE inhrelid = to_regclass('messages_legacy')
+    ) THEN
+        PERFORM setval(
+            pg_get_serial_sequence('messages', 'id'),
+            COALESCE((SELECT MAX(id) FROM messages_legacy), 0) + 1,
+            false
+        );
+        EXECUTE format(
+            'ALTER TABLE messages ATTACH PARTITION messages_legacy FOR VALUES FROM (MINVALUE) TO (%L)',
+            date_trunc('month', NOW()) + INTERVAL '1 month'
+        );
+    END IF;
+END $$;
+
+-- Creates monthly partitions from the current month on; months
+-- the legacy partition already covers are skipped
+CREATE OR REPLACE FUNCTION create_message_partitions(months_ahead INT) RETURNS INT AS $$
+DECLARE
+    month_start TIMESTAMP;
+    partition_name TEXT;
+    created INT := 0;
+BEGIN
+    FOR i IN 0..months_ahead LOOP
+        month_start := date_trunc('month', NOW()) + make_interval(months => i);
+        partition_name := 'messages_' || to_char(month_start, 'YYYY_MM');
+        CONTINUE WHEN to_regclass(partition_name) IS NOT NULL;
+        BEGIN
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF messages FOR VALUES FROM (%L) TO (%L)',
+                partition_name, month_start, month_start + INTERVAL '1 month'
+            );
+            created := created + 1;
+        EXCEPTION WHEN invalid_object_definition THEN
+            NULL;
+        END;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE INDEX IF NOT EXISTS idx_messages_admin_message_id ON messages(admin_message_id);
+CREATE INDEX IF NOT EXISTS idx_messages_ticket_id ON messages(ticket_id);
+
+DROP TRIGGER IF EXISTS trg_messages_user_count ON messages;
+CREATE TRIGGER trg_messages_user_count
+    AFTER INSERT ON messages
+    FOR EACH ROW EXECUTE FUNCTION count_user_message();
+
+DROP TRIGGER IF EXISTS trg_messages_stats ON messages;
+CREATE TRIGGER trg_messages_stats
+    AFTER INSERT ON messages
+    FOR EACH ROW EXECUTE FUNCTION track_message_stats();
+
+SELECT create_message_partitions(3);
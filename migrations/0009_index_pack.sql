@@ -0,0 +1,7 @@
+-- migrate: no-transaction
+-- /stats counts users active since midnight
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_users_last_message_at ON users(last_message_at);
+
+-- Date range scans over messages. Rows arrive in created_at order, so a BRIN
+-- index stays a few pages per partition.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_messages_created_at ON messages USING brin (created_at);
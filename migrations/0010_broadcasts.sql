@@ -0,0 +1,24 @@
+-- Set when a send fails because the user blocked the bot, cleared when they
+-- write again
+ALTER TABLE users ADD COLUMN IF NOT EXISTS bot_blocked BOOLEAN NOT NULL DEFAULT FALSE;
+
+-- Broadcasts walk users in id order; last_user_id is the resume point
+CREATE TABLE IF NOT EXISTS broadcasts (
+    id SERIAL PRIMARY KEY,
+    text TEXT,
+    from_chat_id BIGINT,
+    from_message_id BIGINT,
+    status VARCHAR(20) NOT NULL DEFAULT 'running',
+    status_message_id BIGINT,
+    last_user_id BIGINT NOT NULL DEFAULT 0,
+    total INT NOT NULL DEFAULT 0,
+    sent INT NOT NULL DEFAULT 0,
+    failed INT NOT NULL DEFAULT 0,
+    bot_blocked INT NOT NULL DEFAULT 0,
+    lease_until TIMESTAMP,
+    created_at TIMESTAMP DEFAULT NOW(),
+    finished_at TIMESTAMP
+);
+
+-- One broadcast runs at a time
+CREATE UNIQUE INDEX IF NOT EXISTS uq_broadcasts_running ON broadcasts(status) WHERE status = 'running';
@@ -0,0 +1,66 @@
+-- Every message insert bumps its day's rollup row, so with one row per day
+-- concurrent ingest and outbox transactions queue on the same row lock during
+-- a reply storm. Each connection now writes to one of 8 slot rows per day and
+-- readers sum the slots.
+ALTER TABLE daily_message_counts ADD COLUMN IF NOT EXISTS slot SMALLINT NOT NULL DEFAULT 0;
+
+DO $$
+BEGIN
+    IF (SELECT indnatts FROM pg_index WHERE indexrelid = 'daily_message_counts_pkey'::regclass) = 1 THEN
+        ALTER TABLE daily_message_counts DROP CONSTRAINT daily_message_counts_pkey;
+        ALTER TABLE daily_message_counts ADD CONSTRAINT daily_message_counts_pkey PRIMARY KEY (day, slot);
+    END IF;
+END $$;
+
+CREATE OR REPLACE FUNCTION track_message_stats() RETURNS trigger AS $$
+DECLARE
+    counts_slot SMALLINT := pg_backend_pid() % 8;
+BEGIN
+    INSERT INTO daily_message_counts (day, slot, incoming, outgoing)
+    VALUES (
+        NEW.created_at::date,
+        counts_slot,
+        (NEW.direction = 'incoming')::int,
+        (NEW.direction = 'outgoing')::int
+    )
+    ON CONFLICT (day, slot) DO UPDATE SET
+        incoming = daily_message_counts.incoming + EXCLUDED.incoming,
+        outgoing = daily_message_counts.outgoing + EXCLUDED.outgoing;
+
+    IF NEW.direction = 'incoming' THEN
+        INSERT INTO first_response (message_id, ticket_id, received_at)
+        VALUES (NEW.id, NEW.ticket_id, NEW.created_at);
+    ELSIF NEW.direction = 'outgoing' THEN
+        WITH answered AS (
+            UPDATE first_response SET responded_at = NEW.created_at
+            WHERE ticket_id = NEW.ticket_id
+                AND responded_at IS NULL
+                AND received_at <= NEW.created_at
+            RETURNING received_at, NEW.created_at - received_at AS elapsed
+        )
+        INSERT INTO daily_message_counts (
+            day, slot, responses, response_seconds,
+            responses_5m, responses_30m, responses_2h, responses_over_2h
+        )
+        SELECT
+            received_at::date,
+            counts_slot,
+            COUNT(*),
+            SUM(EXTRACT(EPOCH FROM elapsed)),
+            COUNT(*) FILTER (WHERE elapsed < INTERVAL '5 minutes'),
+            COUNT(*) FILTER (WHERE elapsed >= INTERVAL '5 minutes' AND elapsed < INTERVAL '30 minutes'),
+            COUNT(*) FILTER (WHERE elapsed >= INTERVAL '30 minutes' AND elapsed < INTERVAL '2 hours'),
+            COUNT(*) FILTER (WHERE elapsed >= INTERVAL '2 hours')
+        FROM answered
+        GROUP BY 1
+        ON CONFLICT (day, slot) DO UPDATE SET
+            responses = daily_message_counts.responses + EXCLUDED.responses,
+            response_seconds = daily_message_counts.response_seconds + EXCLUDED.response_seconds,
+            responses_5m = daily_message_counts.responses_5m + EXCLUDED.responses_5m,
+            responses_30m = daily_message_counts.responses_30m + EXCLUDED.responses_30m,
+            responses_2h = daily_message_counts.responses_2h + EXCLUDED.responses_2h,
+            responses_over_2h = daily_message_counts.responses_over_2h + EXCLUDED.responses_over_2h;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
@@ -1,8 +1,11 @@
+from dataclasses import dataclass
 from datetime import datetime
 from pydantic import BaseModel
 
 
-class User(BaseModel):
+# Row records are built straight from asyncpg records, see database.from_row
+@dataclass(slots=True)
+class User:
     id: int
     username: str | None = None
     first_name: str | None = None
@@ -12,7 +15,8 @@ class User(BaseModel):
     last_message_at: datetime | None = None
 
 
-class Ticket(BaseModel):
+@dataclass(slots=True)
+class Ticket:
     id: int
     user_id: int
     status: str = "open"
@@ -20,20 +24,46 @@ class Ticket(BaseModel):
     closed_at: datetime | None = None
 
 
-class Message(BaseModel):
+@dataclass(slots=True)
+class QuickReply:
     id: int
-    ticket_id: int
-    user_id: int
-    user_message_id: int | None = None
+    shortcut: str
+    text: str
+
+
+@dataclass(slots=True)
+class OutboxItem:
+    id: int
+    chat_id: int
+    kind: str
+    ticket_id: int | None = None
+    text: str | None = None
+    from_chat_id: int | None = None
+    from_message_id: int | None = None
     admin_message_id: int | None = None
-    direction: str
+    status: str = "pending"
+    attempts: int = 0
+    next_attempt_at: datetime | None = None
+    last_error: str | None = None
     created_at: datetime | None = None
 
 
-class QuickReply(BaseModel):
+@dataclass(slots=True)
+class Broadcast:
     id: int
-    shortcut: str
-    text: str
+    text: str | None = None
+    from_chat_id: int | None = None
+    from_message_id: int | None = None
+    status: str = "running"
+    status_message_id: int | None = None
+    last_user_id: int = 0
+    total: int = 0
+    sent: int = 0
+    failed: int = 0
+    bot_blocked: int = 0
+    lease_until: datetime | None = None
+    created_at: datetime | None = None
+    finished_at: datetime | None = None
 
 
 class UserStats(BaseModel):
@@ -42,9 +72,14 @@ class UserStats(BaseModel):
 
 
 class Stats(BaseModel):
+    days: int = 7
     total_users: int = 0
     active_today: int = 0
     open_tickets: int = 0
     closed_tickets: int = 0
     avg_response_time_minutes: float | None = None
-    messages_last_7_days: list[tuple[str, int]] = []
+    response_p50_minutes: float | None = None
+    response_p90_minutes: float | None = None
+    response_p99_minutes: float | None = None
+    response_histogram: list[tuple[str, int]] = []
+    messages_per_day: list[tuple[str, int]] = []
@@ -0,0 +1,109 @@
+import asyncio
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from enum import IntEnum
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+
+from config import settings
+from ratelimit import PriorityLimiter, TokenBucket
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+LANE_IDLE_SECONDS = 60
+
+
+class Priority(IntEnum):
+    REPLY = 0  # admin replies and notifications to users
+    NOTICE = 1  # info cards, forwards and answers in the admin chat
+    BULK = 2  # broadcasts and other background traffic
+
+
+send_priority: ContextVar[Priority | None] = ContextVar("send_priority", default=None)
+
+
+@contextmanager
+def priority(value: Priority):
+    token = send_priority.set(value)
+    try:
+        yield
+    finally:
+        send_priority.reset(token)
+
+
+@dataclass
+class ChatLane:
+    bucket: TokenBucket
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    last_used: float = field(default_factory=time.monotonic)
+
+
+class OutboundScheduler(BaseRequestMiddleware):
+    def __init__(self):
+        self.limiter = PriorityLimiter(
+            TokenBucket(settings.send_global_rate, settings.send_global_burst)
+        )
+        self._lanes: dict[int | str, ChatLane] = {}
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            return await make_request(bot, method)
+
+        level = send_priority.get()
+        if level is None:
+            level = Priority.NOTICE if chat_id == settings.admin_id else Priority.REPLY
+
+        lane = self._lane(chat_id)
+        # Holding the lane lock keeps sends to one chat in submission order
+        async with lane.lock:
+            attempt = 0
+            while True:
+                with span("outbound.wait", chat_id=chat_id, priority=level.name):
+                    await lane.bucket.acquire()
+                    await self.limiter.acquire(level)
+                try:
+                    return await make_request(bot, method)
+                except TelegramRetryAfter as e:
+                    attempt += 1
+                    if attempt > settings.send_max_retries:
+                        raise
+                    logger.warning(
+                        "Flood control on %s in chat %s, retrying in %ss",
+                        type(method).__name__,
+                        chat_id,
+                        e.retry_after,
+                    )
+                    lane.bucket.pause(e.retry_after)
+                finally:
+                    lane.last_used = time.monotonic()
+
+    def _lane(self, chat_id: int | str) -> ChatLane:
+        lane = self._lanes.get(chat_id)
+        if lane is None:
+            self._prune()
+            lane = ChatLane(TokenBucket(settings.send_chat_rate, settings.send_chat_burst))
+            self._lanes[chat_id] = lane
+        return lane
+
+    def _prune(self):
+        deadline = time.monotonic() - LANE_IDLE_SECONDS
+        for chat_id, lane in list(self._lanes.items()):
+            if lane.last_used < deadline and not lane.lock.locked():
+                del self._lanes[chat_id]
+
+
+outbound = OutboundScheduler()
@@ -0,0 +1,173 @@
+import asyncio
+import logging
+from collections import defaultdict
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramNotFound
+from aiogram.types import ReactionTypeEmoji, ReplyParameters
+
+from config import settings
+from database import DatabaseUnavailable, db
+from models import OutboxItem
+
+logger = logging.getLogger(__name__)
+
+# Retrying these cannot succeed: the user blocked the bot, the chat or the source message is gone
+PERMANENT_ERRORS = (TelegramForbiddenError, TelegramBadRequest, TelegramNotFound)
+
+
+class OutboxWorker:
+    def __init__(self):
+        self._bot: Bot | None = None
+        self._wakeup = asyncio.Event()
+        self._batch_lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+        self._closing = False
+
+    async def start(self, bot: Bot):
+        self._bot = bot
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        # Let the batch in flight finish so it is not redelivered after restart
+        if self._task:
+            self._closing = True
+            self._wakeup.set()
+            try:
+                await asyncio.wait_for(self._task, settings.outbox_drain_timeout)
+            except TimeoutError:
+                logger.warning("Outbox batch still in flight at shutdown, it will be redelivered")
+            self._task = None
+
+    async def send_text(
+        self,
+        chat_id: int,
+        text: str,
+        ticket_id: int | None = None,
+        admin_message_id: int | None = None,
+    ) -> int:
+        outbox_id = await db.enqueue_outbox(
+            chat_id, "text", ticket_id=ticket_id, text=text, admin_message_id=admin_message_id
+        )
+        self._wakeup.set()
+        return outbox_id
+
+    async def copy_message(
+        self,
+        chat_id: int,
+        from_chat_id: int,
+        message_id: int,
+        ticket_id: int | None = None,
+        admin_message_id: int | None = None,
+    ) -> int:
+        outbox_id = await db.enqueue_outbox(
+            chat_id,
+            "copy",
+            ticket_id=ticket_id,
+            from_chat_id=from_chat_id,
+            from_message_id=message_id,
+            admin_message_id=admin_message_id,
+        )
+        self._wakeup.set()
+        return outbox_id
+
+    async def drain(self):
+        while not self._closing and await self.deliver_due():
+            pass
+
+    async def deliver_due(self) -> int:
+        # One batch at a time per process, so drain() also waits for the one in flight
+        async with self._batch_lock:
+            return await self._deliver_batch()
+
+    async def _deliver_batch(self) -> int:
+        items = await db.claim_outbox(settings.outbox_batch_size, settings.outbox_lease)
+        if not items:
+            return 0
+
+        by_chat: dict[int, list[OutboxItem]] = defaultdict(list)
+        for item in items:
+            by_chat[item.chat_id].append(item)
+        results = await asyncio.gather(*(self._deliver_chat(chat_items) for chat_items in by_chat.values()))
+
+        delivered = [pair for chat_delivered in results for pair, _ in chat_delivered]
+        if delivered:
+            await db.complete_outbox(delivered)
+        await asyncio.gather(*(
+            self._confirm(item)
+            for chat_delivered in results
+            for _, item in chat_delivered
+            if item.admin_message_id is not None
+        ))
+        return len(items)
+
+    async def _deliver_chat(self, items: list[OutboxItem]) -> list[tuple[tuple[int, int], OutboxItem]]:
+        # One chat's messages go out in order; a transient failure holds back the rest
+        delivered = []
+        for index, item in enumerate(items):
+            try:
+                message_id = await self._send(item)
+            except PERMANENT_ERRORS as e:
+                await self._give_up(item, e)
+                continue
+            except Exception as e:
+                delay = min(settings.outbox_backoff_base * 2 ** (item.attempts - 1), settings.outbox_backoff_max)
+                if item.attempts >= settings.outbox_max_attempts:
+                    await self._give_up(item, e)
+                    continue
+                logger.warning("Outbox item %s failed (attempt %s), retrying in %.1fs: %s", item.id, item.attempts, delay, e)
+                await db.retry_outbox([item.id], delay, repr(e))
+                held = [later.id for later in items[index + 1:]]
+                if held:
+                    await db.retry_outbox(held, delay, None, attempted=False)
+                break
+            delivered.append(((item.id, message_id), item))
+        return delivered
+
+    async def _send(self, item: OutboxItem) -> int:
+        if item.kind == "copy":
+            sent = await self._bot.copy_message(item.chat_id, item.from_chat_id, item.from_message_id)
+        else:
+            sent = await self._bot.send_message(item.chat_id, item.text)
+        return sent.message_id
+
+    async def _confirm(self, item: OutboxItem):
+        try:
+            await self._bot.set_message_reaction(
+                settings.admin_id,
+                item.admin_message_id,
+                reaction=[ReactionTypeEmoji(emoji="🕊")],
+            )
+        except Exception:
+            logger.exception("Failed to confirm delivery of outbox item %s", item.id)
+
+    async def _give_up(self, item: OutboxItem, error: Exception):
+        logger.warning("Outbox item %s to chat %s dropped: %s", item.id, item.chat_id, error)
+        await db.fail_outbox(item.id, repr(error))
+        if item.admin_message_id is None:
+            return
+        try:
+            await self._bot.send_message(
+                settings.admin_id,
+                f"Ошибка отправки: {error}",
+                reply_parameters=ReplyParameters(message_id=item.admin_message_id),
+            )
+        except Exception:
+            logger.exception("Failed to report outbox item %s", item.id)
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), settings.outbox_poll_interval)
+            except TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.drain()
+            except DatabaseUnavailable:
+                pass
+            except Exception:
+                logger.exception("Outbox delivery failed")
+
+
+outbox = OutboxWorker()
@@ -0,0 +1,72 @@
+import asyncio
+import logging
+from datetime import datetime
+from pathlib import Path
+
+import asyncpg
+
+from config import settings
+from database import DatabaseUnavailable, db
+
+logger = logging.getLogger(__name__)
+
+
+class PartitionMaintenance:
+    def __init__(self):
+        self._task: asyncio.Task | None = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def run_once(self) -> list[str]:
+        created = await db.create_message_partitions(settings.partition_months_ahead)
+        if created:
+            logger.info("Created %d messages partitions", created)
+        if settings.message_retention_months <= 0:
+            return []
+
+        archive_dir = Path(settings.archive_dir)
+        archive_dir.mkdir(parents=True, exist_ok=True)
+        archived = []
+        for name in await db.expired_message_partitions(retention_cutoff(datetime.now())):
+            path = archive_dir / f"{name}.csv.gz"
+            try:
+                archived_now = await db.archive_message_partition(name, path)
+            except asyncpg.LockNotAvailableError:
+                logger.warning("Partition %s is busy, archiving it on the next cycle", name)
+                break
+            if not archived_now:
+                # Another instance holds the lock and is archiving
+                break
+            logger.info("Archived partition %s to %s", name, path)
+            archived.append(name)
+        return archived
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except DatabaseUnavailable:
+                pass
+            except Exception:
+                logger.exception("Partition maintenance failed")
+            await asyncio.sleep(settings.partition_maintenance_interval)
+
+
+def retention_cutoff(now: datetime) -> datetime:
+    # Whole months only: with 3 months of retention in mid-May, April, March and
+    # February stay online and January is archived
+    months = now.year * 12 + now.month - 1 - settings.message_retention_months
+    return datetime(months // 12, months % 12 + 1, 1)
+
+
+partitions = PartitionMaintenance()
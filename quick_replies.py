@@ -0,0 +1,59 @@
+import asyncio
+import logging
+
+import asyncpg
+
+from database import db
+from models import QuickReply
+
+logger = logging.getLogger(__name__)
+
+
+class QuickReplyRegistry:
+    def __init__(self):
+        self._replies: dict[str, QuickReply] = {}
+        self._reload_task: asyncio.Task | None = None
+        self._dirty = False
+
+    async def start(self):
+        # Subscribe first so nothing committed before the snapshot is missed
+        await db.listen("quick_replies", self._on_notify)
+        await self.reload()
+
+    async def reload(self):
+        replies = await db.get_quick_replies()
+        self._replies = {reply.shortcut: reply for reply in replies}
+
+    def get(self, shortcut: str) -> QuickReply | None:
+        return self._replies.get(shortcut)
+
+    def all(self) -> list[QuickReply]:
+        return [self._replies[shortcut] for shortcut in sorted(self._replies)]
+
+    async def add(self, shortcut: str, text: str) -> QuickReply:
+        reply = await db.add_quick_reply(shortcut, text)
+        self._replies[shortcut] = reply
+        return reply
+
+    async def delete(self, shortcut: str) -> bool:
+        success = await db.delete_quick_reply(shortcut)
+        self._replies.pop(shortcut, None)
+        return success
+
+    def _on_notify(self, conn: asyncpg.Connection, pid: int, channel: str, payload: str):
+        # A change committed after the running reload's SELECT needs one more pass
+        self._dirty = True
+        if self._reload_task and not self._reload_task.done():
+            return
+        self._reload_task = asyncio.create_task(self._reload_logged())
+
+    async def _reload_logged(self):
+        while self._dirty:
+            self._dirty = False
+            try:
+                await self.reload()
+            except Exception:
+                logger.exception("Failed to reload quick replies")
+
+
+quick_replies = QuickReplyRegistry()
@@ -0,0 +1,68 @@
+import asyncio
+import heapq
+import itertools
+import time
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self) -> bool:
+        now = time.monotonic()
+        if now < self._paused_until:
+            return False
+        self._refill(now)
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    def delay(self) -> float:
+        now = time.monotonic()
+        self._refill(now)
+        return max(self._paused_until - now, (1 - self._tokens) / self.rate, 0.0)
+
+    def pause(self, seconds: float):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        while not self.try_acquire():
+            await asyncio.sleep(self.delay())
+
+
+# Hands out bucket tokens to waiters in priority order, lowest value first
+class PriorityLimiter:
+    def __init__(self, bucket: TokenBucket):
+        self.bucket = bucket
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._pump_task: asyncio.Task | None = None
+
+    async def acquire(self, priority: int):
+        if not self._waiters and self.bucket.try_acquire():
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.create_task(self._pump())
+        await future
+
+    async def _pump(self):
+        while self._waiters:
+            future = self._waiters[0][2]
+            if future.done():
+                heapq.heappop(self._waiters)
+            elif self.bucket.try_acquire():
+                heapq.heappop(self._waiters)
+                future.set_result(None)
+            else:
+                await asyncio.sleep(self.bucket.delay())
@@ -1,21 +1,89 @@
-from aiogram import Router, Bot, F
-from aiogram.types import Message, ReactionType, ReactionTypeEmoji
-from aiogram.filters import Command
+import re
+from datetime import date
+
+from aiogram import Bot, Router, F
+from aiogram.enums import ContentType
+from aiogram.types import ErrorEvent, Message
+from aiogram.filters import Command, ExceptionTypeFilter
+from aiogram.utils.text_decorations import html_decoration
 
 from config import settings
-from database import db
-from utils import format_user_info, format_stats
+from blocked_users import blocked_users
+from broadcast import broadcaster
+from database import DatabaseBusy, DatabaseUnavailable, db
+from export import exports, parse_export_args
+from message_index import AdminMessageRef
+from outbox import outbox
+from quick_replies import quick_replies
+from utils import format_broadcast_status, format_user_info, format_stats
 
 router = Router()
 
+MAX_STATS_DAYS = 365
+
+COMMAND_PREFIX = re.compile(r"\S+\s+")
+
+REPLY_CONTENT_TYPES = {
+    ContentType.TEXT,
+    ContentType.PHOTO,
+    ContentType.DOCUMENT,
+    ContentType.VOICE,
+    ContentType.VIDEO,
+    ContentType.STICKER,
+    ContentType.ANIMATION,
+}
+
 
 # Filter: only admin messages
 router.message.filter(F.from_user.id == settings.admin_id)
 
 
+# Ticket status is not cached: another instance may have closed the ticket,
+# or the user may have opened a new one since
+# The text after the command as HTML: the admin's formatting is kept and
+# everything else is escaped, so it is sent exactly as typed
+def _html_after_command(message: Message) -> str:
+    # The command and the whitespace after it are one UTF-16 unit per character
+    prefix = len(COMMAND_PREFIX.match(message.text)[0])
+    entities = []
+    for entity in message.entities or ():
+        end = entity.offset + entity.length
+        if end <= prefix:
+            continue
+        start = max(entity.offset, prefix)
+        entities.append(entity.model_copy(update={"offset": start - prefix, "length": end - start}))
+    return html_decoration.unparse(message.text[prefix:], entities)
+
+
+async def _open_ticket_id(ref: AdminMessageRef) -> int | None:
+    ticket = await db.get_open_ticket(ref.user_id)
+    return ticket.id if ticket else None
+
+
+@router.error(ExceptionTypeFilter(DatabaseBusy), F.update.message.as_("message"))
+async def on_database_busy(event: ErrorEvent, message: Message):
+    await message.answer("⚠️ База данных перегружена, попробуйте позже")
+
+
+@router.error(ExceptionTypeFilter(DatabaseUnavailable), F.update.message.as_("message"))
+async def on_database_unavailable(event: ErrorEvent, message: Message):
+    await message.answer("⚠️ База данных недоступна, попробуйте позже")
+
+
 @router.message(Command("stats"))
 async def cmd_stats(message: Message):
-    stats = await db.get_stats()
+    args = message.text.split(maxsplit=1)
+    days = 7
+    if len(args) > 1:
+        try:
+            days = int(args[1].strip().removesuffix("d"))
+        except ValueError:
+            days = 0
+        if not 1 <= days <= MAX_STATS_DAYS:
+            await message.answer(f"Использование: /stats [дней]d, например /stats 30d (до {MAX_STATS_DAYS})")
+            return
+
+    stats = await db.get_stats(days)
     await message.answer(format_stats(stats))
 
 
@@ -54,7 +122,7 @@ async def cmd_block(message: Message):
         await message.answer("ID должен быть числом")
         return
 
-    success = await db.block_user(user_id)
+    success = await blocked_users.block(user_id)
     if success:
         await message.answer(f"Пользователь {user_id} заблокирован")
     else:
@@ -74,42 +142,85 @@ async def cmd_unblock(message: Message):
         await message.answer("ID должен быть числом")
         return
 
-    success = await db.unblock_user(user_id)
+    success = await blocked_users.unblock(user_id)
     if success:
         await message.answer(f"Пользователь {user_id} разблокирован")
     else:
         await message.answer("Пользователь не найден")
 
 
+@router.message(Command("broadcast"))
+async def cmd_broadcast(message: Message):
+    args = message.text.split(maxsplit=1)
+    if len(args) > 1 and args[1].strip() == "stop":
+        broadcast = await broadcaster.stop()
+        if broadcast:
+            await message.answer(f"Рассылка #{broadcast.id} остановлена")
+        else:
+            await message.answer("Нет активной рассылки")
+        return
+
+    # A reply broadcasts the replied message as is, media and formatting included
+    source = message.reply_to_message
+    if not source and len(args) < 2:
+        await message.answer(
+            "Использование: /broadcast <текст> или ответьте командой /broadcast на сообщение\n"
+            "Остановить: /broadcast stop"
+        )
+        return
+
+    status = await message.answer("📣 Рассылка запускается…")
+    if source:
+        broadcast = await broadcaster.begin(
+            status.message_id, from_chat_id=source.chat.id, from_message_id=source.message_id
+        )
+    else:
+        broadcast = await broadcaster.begin(status.message_id, text=_html_after_command(message))
+
+    if broadcast:
+        await status.edit_text(format_broadcast_status(broadcast))
+    else:
+        await status.edit_text("Рассылка уже идёт. Остановить: /broadcast stop")
+
+
+@router.message(Command("export"))
+async def cmd_export(message: Message, bot: Bot):
+    try:
+        tables, start, end, fmt = parse_export_args(message.text.split()[1:], date.today())
+    except ValueError:
+        await message.answer(
+            "Использование: /export [tickets|messages|users] [с ГГГГ-ММ-ДД] [по ГГГГ-ММ-ДД] [csv|jsonl]\n"
+            "По умолчанию — все таблицы за последние 30 дней в CSV"
+        )
+        return
+
+    await message.answer(f"⏳ Экспорт {', '.join(tables)} за {start} — {end} ({fmt}) запущен")
+    exports.submit(bot, tables, start, end, fmt)
+
+
 @router.message(Command("close"))
-async def cmd_close(message: Message, bot: Bot):
+async def cmd_close(message: Message):
     if not message.reply_to_message:
         await message.answer("Ответьте на сообщение пользователя командой /close")
         return
 
     # Find ticket by replied message
-    ticket = await db.get_ticket_by_admin_message(message.reply_to_message.message_id)
-    if not ticket:
+    ref = await db.lookup_admin_message(message.reply_to_message.message_id)
+    if not ref:
         await message.answer("Тикет не найден")
         return
 
-    if ticket.status == "closed":
-        await message.answer(f"Тикет #{ticket.id} уже закрыт")
+    if not await db.close_ticket(ref.ticket_id):
+        await message.answer(f"Тикет #{ref.ticket_id} уже закрыт")
         return
 
-    await db.close_ticket(ticket.id)
-    await message.answer(f"Тикет #{ticket.id} закрыт")
+    await message.answer(f"Тикет #{ref.ticket_id} закрыт")
 
     # Notify user
-    user = await db.get_user(ticket.user_id)
-    if user:
-        try:
-            await bot.send_message(
-                ticket.user_id,
-                f"Ваше обращение #{ticket.id} закрыто. Напишите снова, если нужна помощь.",
-            )
-        except Exception:
-            pass
+    await outbox.send_text(
+        ref.user_id,
+        f"Ваше обращение #{ref.ticket_id} закрыто. Напишите снова, если нужна помощь.",
+    )
 
 
 @router.message(Command("quick"))
@@ -117,7 +228,7 @@ async def cmd_quick(message: Message):
     args = message.text.split(maxsplit=2)
 
     if len(args) == 1:
-        replies = await db.get_quick_replies()
+        replies = quick_replies.all()
         if not replies:
             await message.answer("Быстрые ответы не настроены. Добавьте: /quick add <shortcut> <text>")
             return
@@ -140,7 +251,7 @@ async def cmd_quick(message: Message):
             return
 
         shortcut, text = parts
-        await db.add_quick_reply(shortcut, text)
+        await quick_replies.add(shortcut, text)
         await message.answer(f"Быстрый ответ '{shortcut}' сохранён")
         return
 
@@ -151,7 +262,7 @@ async def cmd_quick(message: Message):
             return
 
         shortcut = args[2].split()[0]
-        success = await db.delete_quick_reply(shortcut)
+        success = await quick_replies.delete(shortcut)
         if success:
             await message.answer(f"Быстрый ответ '{shortcut}' удалён")
         else:
@@ -162,7 +273,7 @@ async def cmd_quick(message: Message):
 
 
 @router.message(Command("q"))
-async def cmd_q(message: Message, bot: Bot):
+async def cmd_q(message: Message):
     if not message.reply_to_message:
         await message.answer("Ответьте на сообщение пользователя командой /q <shortcut>")
         return
@@ -173,99 +284,42 @@ async def cmd_q(message: Message, bot: Bot):
         return
 
     shortcut = args[1].strip()
-    reply = await db.get_quick_reply(shortcut)
+    reply = quick_replies.get(shortcut)
     if not reply:
         await message.answer(f"Быстрый ответ '{shortcut}' не найден")
         return
 
     # Find user by replied message
-    msg = await db.get_message_by_admin_id(message.reply_to_message.message_id)
-    if not msg:
+    ref = await db.lookup_admin_message(message.reply_to_message.message_id)
+    if not ref:
         await message.answer("Сообщение не найдено в базе")
         return
 
-    # Send quick reply to user
-    try:
-        sent = await bot.send_message(msg.user_id, reply.text)
-        await message.answer(f"✅ Отправлено")
-
-        # Save outgoing message
-        ticket = await db.get_open_ticket(msg.user_id)
-        if ticket:
-            await db.save_message(
-                ticket_id=ticket.id,
-                user_id=msg.user_id,
-                user_message_id=sent.message_id,
-                admin_message_id=None,
-                direction="outgoing",
-            )
-    except Exception as e:
-        await message.answer(f"Ошибка отправки: {e}")
+    # Queue quick reply; the command gets a reaction once it is delivered
+    await outbox.send_text(
+        ref.user_id,
+        reply.text,
+        ticket_id=await _open_ticket_id(ref),
+        admin_message_id=message.message_id,
+    )
 
 
 @router.message(F.reply_to_message)
-async def handle_admin_reply(message: Message, bot: Bot):
+async def handle_admin_reply(message: Message):
     # Find the original message by admin_message_id
-    original = await db.get_message_by_admin_id(message.reply_to_message.message_id)
-    if not original:
+    ref = await db.lookup_admin_message(message.reply_to_message.message_id)
+    if not ref:
         return
 
-    user_id = original.user_id
-
-    # Check if user is blocked
-    user = await db.get_user(user_id)
-    if not user:
-        await message.answer("Пользователь не найден")
+    if message.content_type not in REPLY_CONTENT_TYPES:
+        await message.answer("Этот тип сообщения не поддерживается")
         return
 
-    # Send reply to user
-    try:
-        if message.text:
-            sent = await bot.send_message(user_id, message.text)
-        elif message.photo:
-            sent = await bot.send_photo(
-                user_id,
-                message.photo[-1].file_id,
-                caption=message.caption,
-            )
-        elif message.document:
-            sent = await bot.send_document(
-                user_id,
-                message.document.file_id,
-                caption=message.caption,
-            )
-        elif message.voice:
-            sent = await bot.send_voice(user_id, message.voice.file_id)
-        elif message.video:
-            sent = await bot.send_video(
-                user_id,
-                message.video.file_id,
-                caption=message.caption,
-            )
-        elif message.sticker:
-            sent = await bot.send_sticker(user_id, message.sticker.file_id)
-        elif message.animation:
-            sent = await bot.send_animation(
-                user_id,
-                message.animation.file_id,
-                caption=message.caption,
-            )
-        else:
-            await message.answer("Этот тип сообщения не поддерживается")
-            return
-
-        # Save outgoing message
-        ticket = await db.get_open_ticket(user_id)
-        if ticket:
-            await db.save_message(
-                ticket_id=ticket.id,
-                user_id=user_id,
-                user_message_id=sent.message_id,
-                admin_message_id=None,
-                direction="outgoing",
-            )
-
-        await message.react(reaction=[ReactionTypeEmoji(emoji="🕊")])
-
-    except Exception as e:
-        await message.answer(f"Ошибка отправки: {e}")
+    # Queue a copy for the user; the reply gets a reaction once it is delivered
+    await outbox.copy_message(
+        ref.user_id,
+        message.chat.id,
+        message.message_id,
+        ticket_id=await _open_ticket_id(ref),
+        admin_message_id=message.message_id,
+    )
@@ -1,14 +1,23 @@
+import logging
+
 from aiogram import Router, Bot, F
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.types import Message
 from aiogram.filters import Command
 
+from coalescer import BurstCoalescer
 from config import settings
-from database import db
+from database import DatabaseUnavailable, db
 from models import User
-from utils import format_user_card
+from spool import spool
+from utils import format_degraded_user_card, format_user_card
+
+logger = logging.getLogger(__name__)
 
 router = Router()
 
+FORWARD_BATCH_SIZE = 100
+
 WELCOME_MESSAGE = """👋 Добро пожаловать в поддержку BOVPN!
 
 Опишите вашу проблему или задайте вопрос — мы ответим как можно скорее.
@@ -26,26 +35,80 @@ async def cmd_start(message: Message):
 
 
 async def forward_to_admin(message: Message, bot: Bot, db_user: User):
-    if db_user.is_blocked:
-        await message.answer("Вы заблокированы в поддержке.")
-        return
+    bursts.add(message, bot, db_user)
 
-    ticket = await db.get_or_create_ticket(db_user.id)
-    stats = await db.get_user_stats(db_user.id)
 
-    info_card = format_user_card(db_user, ticket, stats)
+async def deliver_burst(bot: Bot, db_user: User, messages: list[Message]):
+    # Any database failure falls back to the spool: the messages must reach the admin
+    try:
+        ticket, stats = await db.ingest_incoming(db_user.id)
+    except DatabaseUnavailable:
+        ticket = stats = None
+    except Exception:
+        # Query errors too, e.g. a user first seen in degraded mode has no row yet
+        logger.exception("Failed to open a ticket for user %d, spooling the burst", db_user.id)
+        ticket = stats = None
 
-    await bot.send_message(settings.admin_id, info_card)
+    if ticket:
+        info_card = format_user_card(db_user, ticket, stats)
+    else:
+        info_card = format_degraded_user_card(db_user)
 
-    forwarded = await message.forward(settings.admin_id)
+    await bot.send_message(settings.admin_id, info_card)
 
-    await db.save_message(
-        ticket_id=ticket.id,
-        user_id=db_user.id,
-        user_message_id=message.message_id,
-        admin_message_id=forwarded.message_id,
-        direction="incoming",
-    )
+    # forward_messages keeps albums grouped and returns ids in message_id order
+    messages = sorted(messages, key=lambda m: m.message_id)
+    forwarded_ids = []
+    for start in range(0, len(messages), FORWARD_BATCH_SIZE):
+        chunk = messages[start:start + FORWARD_BATCH_SIZE]
+        forwarded = await bot.forward_messages(
+            settings.admin_id,
+            from_chat_id=chunk[0].chat.id,
+            message_ids=[m.message_id for m in chunk],
+        )
+        if len(forwarded) == len(chunk):
+            forwarded_ids.extend(
+                (original.message_id, copy.message_id)
+                for original, copy in zip(chunk, forwarded)
+            )
+            continue
+        # Some messages were skipped (deleted during the debounce window), so
+        # the pairing is unknown: take the partial batch back and forward the
+        # chunk one by one so every saved id pair is certain
+        logger.warning(
+            "Forwarded %d of %d messages from user %d, forwarding one by one",
+            len(forwarded), len(chunk), db_user.id,
+        )
+        if forwarded:
+            try:
+                await bot.delete_messages(settings.admin_id, [copy.message_id for copy in forwarded])
+            except TelegramBadRequest:
+                logger.warning("Could not remove the partial forward of user %d", db_user.id)
+        for original in chunk:
+            try:
+                copy = await bot.forward_message(settings.admin_id, original.chat.id, original.message_id)
+            except TelegramBadRequest:
+                continue
+            forwarded_ids.append((original.message_id, copy.message_id))
+
+    if not forwarded_ids:
+        return
+    if ticket:
+        rows = [
+            (ticket.id, db_user.id, user_message_id, admin_message_id, "incoming")
+            for user_message_id, admin_message_id in forwarded_ids
+        ]
+        try:
+            await db.save_messages(rows)
+            return
+        except DatabaseUnavailable:
+            logger.warning("Database went away mid-burst, spooling messages from user %d", db_user.id)
+        except Exception:
+            logger.exception("Failed to save the burst, spooling messages from user %d", db_user.id)
+    spool.append(db_user.id, db_user.username, db_user.first_name, db_user.last_name, forwarded_ids)
+
+
+bursts = BurstCoalescer(deliver_burst)
 
 
 @router.message(F.from_user.id != settings.admin_id, F.text)
@@ -0,0 +1,120 @@
+import asyncio
+import json
+import logging
+from datetime import datetime
+from pathlib import Path
+
+from config import settings
+from database import DatabaseUnavailable, db
+
+logger = logging.getLogger(__name__)
+
+
+# Append-only JSONL of incoming messages that reached the admin while the
+# database was unavailable; replayed in bulk once it is back
+class Spool:
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self._replaying = self.path.with_name(self.path.name + ".replaying")
+        self._lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+
+    async def start(self):
+        if self.path.exists() or self._replaying.exists():
+            self._schedule()
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def append(
+        self,
+        user_id: int,
+        username: str | None,
+        first_name: str | None,
+        last_name: str | None,
+        messages: list[tuple[int, int]],
+    ):
+        record = {
+            "at": datetime.now().isoformat(),
+            "user_id": user_id,
+            "username": username,
+            "first_name": first_name,
+            "last_name": last_name,
+            "messages": messages,
+        }
+        with self.path.open("a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._schedule()
+
+    async def replay(self) -> int:
+        replayed = 0
+        async with self._lock:
+            while True:
+                if not self._replaying.exists():
+                    if not self.path.exists():
+                        return replayed
+                    # New records keep going to a fresh file while this one is replayed
+                    self.path.rename(self._replaying)
+                records = self._read(self._replaying)
+                if records:
+                    await self._replay(records)
+                self._replaying.unlink()
+                replayed += len(records)
+                logger.info("Replayed %d spooled bursts", len(records))
+
+    async def _replay(self, records: list[dict]):
+        users = {}
+        messages = []
+        for record in records:
+            at = datetime.fromisoformat(record["at"])
+            users[record["user_id"]] = (
+                record["user_id"],
+                record["username"],
+                record["first_name"],
+                record["last_name"],
+                at,
+            )
+            messages.extend(
+                (record["user_id"], user_message_id, admin_message_id, at)
+                for user_message_id, admin_message_id in record["messages"]
+            )
+        await db.upsert_users(list(users.values()))
+        if messages:
+            await db.replay_incoming(messages)
+
+    def _read(self, path: Path) -> list[dict]:
+        records = []
+        with path.open(encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # A crash mid-append leaves a torn last line
+                    logger.warning("Skipping unreadable spool line in %s", path)
+        return records
+
+    def _schedule(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._replay_until_done())
+
+    async def _replay_until_done(self):
+        while True:
+            try:
+                await self.replay()
+                return
+            except DatabaseUnavailable:
+                pass
+            except Exception:
+                logger.exception("Spool replay failed")
+            await asyncio.sleep(settings.spool_replay_interval)
+
+
+spool = Spool(settings.spool_path)
@@ -0,0 +1,109 @@
+import json
+import logging
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Iterator, TextIO
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class Trace:
+    def __init__(self, kind: str, **attrs: Any):
+        self.kind = kind
+        self.attrs = attrs
+        self.started_at = datetime.now()
+        self.started = time.perf_counter()
+        self.duration_ms = 0.0
+        self.spans: list[dict[str, Any]] = []
+        self.finished = False
+
+    def add(self, name: str, started: float, ended: float, attrs: dict[str, Any]):
+        self.spans.append({
+            "name": name,
+            "start_ms": round((started - self.started) * 1000, 3),
+            "duration_ms": round((ended - started) * 1000, 3),
+            **attrs,
+        })
+
+    def finish(self):
+        self.duration_ms = (time.perf_counter() - self.started) * 1000
+        self.finished = True
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "kind": self.kind,
+            **self.attrs,
+            "started_at": self.started_at.isoformat(),
+            "duration_ms": round(self.duration_ms, 3),
+            "spans": self.spans,
+        }
+
+
+current_trace: ContextVar[Trace | None] = ContextVar("current_trace", default=None)
+
+_trace_file: TextIO | None = None
+
+
+@contextmanager
+def trace(kind: str, **attrs: Any) -> Iterator[Trace]:
+    current = Trace(kind, **attrs)
+    token = current_trace.set(current)
+    try:
+        yield current
+    finally:
+        current_trace.reset(token)
+        current.finish()
+        _emit(current)
+
+
+@contextmanager
+def span(name: str, **attrs: Any) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, started, time.perf_counter(), **attrs)
+
+
+def record_span(name: str, started: float, ended: float, **attrs: Any):
+    current = current_trace.get()
+    # Background tasks inherit the context of an update that may have finished already
+    if current is not None and not current.finished:
+        current.add(name, started, ended, attrs)
+
+
+def _emit(finished: Trace):
+    slow = finished.duration_ms >= settings.trace_slow_ms
+    if slow:
+        logger.warning("Slow %s: %s", finished.kind, json.dumps(finished.to_dict(), ensure_ascii=False))
+    if settings.trace_file and (slow or random.random() < settings.trace_sample_rate):
+        _write(finished)
+
+
+def _write(finished: Trace):
+    global _trace_file
+    if _trace_file is None:
+        _trace_file = open(settings.trace_file, "a", encoding="utf-8", buffering=1)
+    _trace_file.write(json.dumps(finished.to_dict(), ensure_ascii=False) + "\n")
+
+
+class TracingMiddleware(BaseMiddleware):
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        if not isinstance(event, Update):
+            return await handler(event, data)
+
+        with trace("update", update_id=event.update_id, event_type=event.event_type):
+            return await handler(event, data)
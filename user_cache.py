@@ -0,0 +1,117 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from dataclasses import replace
+from datetime import datetime
+
+from config import settings
+from database import DatabaseUnavailable, db
+from models import User
+
+logger = logging.getLogger(__name__)
+
+PendingUser = tuple[int, str | None, str | None, str | None, datetime]
+
+
+class UserCache:
+    def __init__(self):
+        self._users: OrderedDict[int, User] = OrderedDict()
+        self._pending: dict[int, PendingUser] = {}
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await self.flush()
+        except DatabaseUnavailable:
+            logger.warning("Database unavailable, dropping %d pending user updates", len(self._pending))
+
+    async def touch(
+        self,
+        user_id: int,
+        username: str | None,
+        first_name: str | None,
+        last_name: str | None,
+    ) -> User:
+        user = self._users.get(user_id)
+        if user is None:
+            # First sighting: the row has to exist before tickets reference it
+            try:
+                user = await db.upsert_user(user_id, username, first_name, last_name)
+            except DatabaseUnavailable:
+                # Degraded mode: the spool replays the row once the database is back
+                return User(
+                    id=user_id,
+                    username=username,
+                    first_name=first_name,
+                    last_name=last_name,
+                    last_message_at=datetime.now(),
+                )
+            self._remember(user)
+            return user
+
+        now = datetime.now()
+        user = replace(
+            user,
+            username=username,
+            first_name=first_name,
+            last_name=last_name,
+            last_message_at=now,
+        )
+        self._remember(user)
+        self._pending[user_id] = (user_id, username, first_name, last_name, now)
+        if len(self._pending) >= settings.user_flush_batch_size:
+            self._wakeup.set()
+        return user
+
+    def set_blocked(self, user_id: int, is_blocked: bool):
+        user = self._users.get(user_id)
+        if user:
+            self._users[user_id] = replace(user, is_blocked=is_blocked)
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, {}
+            try:
+                await db.upsert_users(list(batch.values()))
+            except Exception:
+                # Keep newer changes that arrived while the flush was running
+                for user_id, row in batch.items():
+                    self._pending.setdefault(user_id, row)
+                raise
+
+    def _remember(self, user: User):
+        self._users[user.id] = user
+        self._users.move_to_end(user.id)
+        while len(self._users) > settings.user_cache_size:
+            self._users.popitem(last=False)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), settings.user_flush_interval)
+            except TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except DatabaseUnavailable:
+                pass
+            except Exception:
+                logger.exception("Failed to flush %d pending users", len(self._pending))
+
+
+user_cache = UserCache()
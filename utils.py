@@ -1,4 +1,6 @@
-from models import User, Ticket, UserStats
+from datetime import datetime, timedelta
+
+from models import Broadcast, User, Ticket, UserStats
 
 
 def format_user_card(user: User, ticket: Ticket, stats: UserStats) -> str:
@@ -19,6 +21,20 @@ def format_user_card(user: User, ticket: Ticket, stats: UserStats) -> str:
     )
 
 
+def format_degraded_user_card(user: User) -> str:
+    username_str = f"@{user.username}" if user.username else "нет"
+    name_parts = [user.first_name or "", user.last_name or ""]
+    full_name = " ".join(p for p in name_parts if p) or "Неизвестно"
+
+    return (
+        f"📨 Новое сообщение\n\n"
+        f"👤 Имя: {full_name} (`{username_str}`)\n"
+        f"🆔 ID: `{user.id}`\n"
+        f"⚠️ База данных недоступна, сообщение сохранено локально\n"
+        f"───────────────────"
+    )
+
+
 def format_user_info(user: User, stats: UserStats) -> str:
     username_str = f"@{user.username}" if user.username else "нет"
     name_parts = [user.first_name or "", user.last_name or ""]
@@ -53,10 +69,62 @@ def format_stats(stats) -> str:
         f"⏱ Среднее время ответа: {avg_response}",
     ]
 
-    if stats.messages_last_7_days:
-        lines.append("\n📈 Сообщений за последние 7 дней:")
-        for date, count in stats.messages_last_7_days:
-            bar = "█" * min(count // 5, 20)
-            lines.append(f"  {date}: {bar} {count}")
+    if stats.response_p50_minutes is not None:
+        lines.append(
+            f"⏱ Первый ответ p50/p90/p99: {stats.response_p50_minutes} / "
+            f"{stats.response_p90_minutes} / {stats.response_p99_minutes} мин"
+        )
+
+    total_responses = sum(count for _, count in stats.response_histogram)
+    if total_responses:
+        lines.append("\n🎯 Время первого ответа:")
+        for label, count in stats.response_histogram:
+            share = round(count * 100 / total_responses)
+            bar = "█" * (share // 5)
+            lines.append(f"  {label}: {bar} {count} ({share}%)")
+
+    if stats.messages_per_day:
+        lines.append(f"\n📈 Сообщений за последние {stats.days} дней:")
+        if stats.days <= 14:
+            for date, count in stats.messages_per_day:
+                bar = "█" * min(count // 5, 20)
+                lines.append(f"  {date}: {bar} {count}")
+        else:
+            for week_start, count in _group_by_week(stats.messages_per_day):
+                bar = "█" * min(count // 35, 20)
+                lines.append(f"  с {week_start}: {bar} {count}")
+
+    return "\n".join(lines)
+
 
+BROADCAST_STATUS_TITLES = {
+    "running": "📣 Рассылка #{id}",
+    "done": "✅ Рассылка #{id} завершена",
+    "cancelled": "⏹ Рассылка #{id} остановлена",
+}
+
+
+def format_broadcast_status(broadcast: Broadcast, rate: float | None = None) -> str:
+    title = BROADCAST_STATUS_TITLES.get(broadcast.status, "📣 Рассылка #{id}").format(id=broadcast.id)
+    processed = broadcast.sent + broadcast.failed + broadcast.bot_blocked
+    lines = [
+        f"{title}\n",
+        f"📤 Обработано: {processed} из {broadcast.total}",
+        f"✅ Доставлено: {broadcast.sent}",
+        f"🚫 Заблокировали бота: {broadcast.bot_blocked}",
+        f"⚠️ Ошибок: {broadcast.failed}",
+    ]
+    if rate is not None:
+        lines.append(f"⚡️ Скорость: {rate:.1f} сообщ./с")
+    if broadcast.status == "running":
+        lines.append("\nОстановить: /broadcast stop")
     return "\n".join(lines)
+
+
+def _group_by_week(messages_per_day: list[tuple[str, int]]) -> list[tuple[str, int]]:
+    weeks: dict[str, int] = {}
+    for date, count in messages_per_day:
+        day = datetime.strptime(date, "%Y-%m-%d").date()
+        week_start = str(day - timedelta(days=day.weekday()))
+        weeks[week_start] = weeks.get(week_start, 0) + count
+    return list(weeks.items())
@@ -0,0 +1,132 @@
+import asyncio
+import logging
+from typing import Any
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+from config import settings
+from database import db
+
+logger = logging.getLogger(__name__)
+
+
+class QueuedRequestHandler(SimpleRequestHandler):
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, **data: Any):
+        super().__init__(
+            dispatcher,
+            bot,
+            handle_in_background=True,
+            secret_token=settings.webhook_secret,
+            **data,
+        )
+        self.queue: asyncio.Queue[dict[str, Any]] = asyncio.Queue(settings.webhook_queue_size)
+        self._workers: list[asyncio.Task] = []
+        self._gate = asyncio.Lock()
+
+    def register(self, app: web.Application, /, path: str, **kwargs: Any):
+        app.on_startup.append(self._start_workers)
+        super().register(app, path, **kwargs)
+
+    async def _start_workers(self, app: web.Application):
+        self._workers = [
+            asyncio.create_task(self._worker()) for _ in range(settings.webhook_workers)
+        ]
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        update = await request.json(loads=bot.session.json_loads)
+        try:
+            await asyncio.wait_for(self.queue.put(update), settings.webhook_enqueue_timeout)
+        except TimeoutError:
+            # Telegram redelivers updates that were not acknowledged with 2xx
+            logger.warning("Update queue is full, rejecting update %s", update.get("update_id"))
+            return web.Response(status=503, text="Busy")
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+    async def _worker(self):
+        while True:
+            # Backpressure is applied before dequeuing and one worker at a time,
+            # so updates still leave the queue, and take their user lock, in order
+            async with self._gate:
+                await self._wait_for_db()
+                update = await self.queue.get()
+            try:
+                await self._background_feed_update(self.bot, update)
+            except Exception:
+                logger.exception("Failed to process update %s", update.get("update_id"))
+            finally:
+                self.queue.task_done()
+
+    async def _wait_for_db(self):
+        # Hold updates back while every pool connection is busy instead of piling up waiters.
+        # Only the write pool counts: user updates write, and reads fall back to it anyway.
+        pool = db.pool
+        while pool and pool.get_idle_size() == 0 and pool.get_size() >= pool.get_max_size():
+            await asyncio.sleep(0.05)
+
+    async def close(self):
+        try:
+            await asyncio.wait_for(self.queue.join(), settings.webhook_drain_timeout)
+        except TimeoutError:
+            logger.warning("Dropping %d queued updates on shutdown", self.queue.qsize())
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        await super().close()
+
+    async def health(self, request: web.Request) -> web.Response:
+        pool = db.pool
+        healthy = pool is not None and not pool.is_closing()
+        body = {
+            "status": "ok" if healthy else "unavailable",
+            "queue": self.queue.qsize(),
+            "queue_size": self.queue.maxsize,
+            "workers": len(self._workers),
+            "db_pool": {
+                "size": pool.get_size(),
+                "idle": pool.get_idle_size(),
+                "max": pool.get_max_size(),
+            } if pool else None,
+            "db_read_pool": {
+                "size": db.read_pool.get_size(),
+                "idle": db.read_pool.get_idle_size(),
+                "max": db.read_pool.get_max_size(),
+                "replica_lag": db.replica_lag,
+            } if db.read_pool else None,
+        }
+        return web.json_response(body, status=200 if healthy else 503)
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot):
+    app = web.Application()
+
+    handler = QueuedRequestHandler(dp, bot)
+    # Registered before setup_application so the queue drains before on_shutdown closes the DB
+    handler.register(app, path=settings.webhook_path)
+    app.router.add_get("/healthz", handler.health)
+    setup_application(app, dp, bot=bot)
+
+    if settings.webhook_url:
+        async def set_webhook(app: web.Application):
+            await bot.set_webhook(
+                settings.webhook_url.rstrip("/") + settings.webhook_path,
+                secret_token=settings.webhook_secret,
+                allowed_updates=dp.resolve_used_update_types(),
+            )
+            logger.info("Webhook set to %s", settings.webhook_url)
+
+        app.on_startup.append(set_webhook)
+    else:
+        logger.info("WEBHOOK_URL is not set, serving updates posted directly to the server")
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, settings.webhook_host, settings.webhook_port)
+    await site.start()
+    logger.info("Webhook server listening on %s:%d", settings.webhook_host, settings.webhook_port)
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()